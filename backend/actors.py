@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import traceback
+
+# Every room runs as an actor: events for a room go into that room's inbox and are handled one
+# after another, never two at once, so whoever's answer arrives first is the one that counts.
+#
+# A room's events are handled in ticks. Everything the handlers emit during a tick is collected
+# and sent as one 'state_update' frame per target, {'events': [[event, data], ...]}, instead of
+# one frame per emit.
+
+# Most events handled in one tick before other rooms get a turn
+MAX_EVENTS_PER_TICK = 256
+
+
+# The `out` given to game handlers during a tick (see game.py)
+class FrameBatcher:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.room_ops = []   # ('enter' | 'leave', sid, room) in the order they were asked for
+        self.frames = {}     # target -> [[event, data], ...], dicts keep first-emit order
+
+    def emit(self, event, data, to):
+        self.frames.setdefault(to, []).append([event, data])
+
+    def enter_room(self, sid, room):
+        self.room_ops.append(('enter', sid, room))
+
+    def leave_room(self, sid, room):
+        self.room_ops.append(('leave', sid, room))
+
+    # (target, events) pairs to send. Frames for single sockets and other rooms go before the
+    # actor's own room, so e.g. a joining player gets their backlog before the room's new messages.
+    def take_frames(self):
+        own = self.frames.pop(self.session_id, None)
+        frames = list(self.frames.items())
+        if own:
+            frames.append((self.session_id, own))
+        self.frames = {}
+        return frames
+
+
+class RoomActor:
+    __slots__ = ('session_id', 'inbox', 'scheduled')
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.inbox = []
+        self.scheduled = False
+
+
+# Keeps the actors and decides which socket events go to which one.
+# Subclasses decide what a tick runs on (thread pool or event loop).
+class BaseScheduler:
+    def __init__(self, room_exists):
+        self.room_exists = room_exists  # So actors for rooms that are gone can be dropped
+        self._actors = {}
+        self._sid_rooms = {}  # sid -> room it last asked to join, for routing its later events
+        self._lock = threading.Lock()
+
+    # Queue handler(*args, out) on a room's actor
+    def submit(self, session_id, handler, *args):
+        with self._lock:
+            actor = self._actors.get(session_id)
+            if actor is None:
+                actor = self._actors[session_id] = RoomActor(session_id)
+            actor.inbox.append((handler, args))
+            if actor.scheduled:
+                return
+            actor.scheduled = True
+        self._schedule(actor)
+
+    # A socket's events go to the room it joined, even if that join hasn't been handled yet
+    def submit_join(self, sid, session_id, handler, *args):
+        with self._lock:
+            self._sid_rooms[sid] = session_id
+        self.submit(session_id, handler, *args)
+
+    def submit_for_sid(self, sid, handler, *args):
+        self.submit(self._sid_rooms.get(sid), handler, *args)
+
+    def forget_sid(self, sid):
+        with self._lock:
+            self._sid_rooms.pop(sid, None)
+
+    # Handle one tick's worth of events, returns the batcher holding what they sent
+    def _tick(self, actor):
+        with self._lock:
+            events = actor.inbox[:MAX_EVENTS_PER_TICK]
+            del actor.inbox[:MAX_EVENTS_PER_TICK]
+
+        batch = FrameBatcher(actor.session_id)
+        for handler, args in events:
+            try:
+                handler(*args, batch)
+            except Exception:
+                # One bad event shouldn't take the room down with it
+                traceback.print_exc()
+        return batch
+
+    # After a tick: go again if more events came in, otherwise go idle (and drop the actor if
+    # its room is gone). Returns True if the actor needs another tick.
+    def _done(self, actor):
+        with self._lock:
+            if actor.inbox:
+                return True
+            actor.scheduled = False
+            if not self.room_exists(actor.session_id) and self._actors.get(actor.session_id) is actor:
+                del self._actors[actor.session_id]
+            return False
+
+
+# Runs ticks on a pool of threads, for the threading server.
+# `transport` needs enter_room(sid, room), leave_room(sid, room) and send_frame(target, events).
+class ActorScheduler(BaseScheduler):
+    def __init__(self, transport, room_exists, workers=8):
+        super().__init__(room_exists)
+        self.transport = transport
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='room-actor')
+
+    def _schedule(self, actor):
+        self._pool.submit(self._run, actor)
+
+    def _run(self, actor):
+        try:
+            batch = self._tick(actor)
+            for op, sid, room in batch.room_ops:
+                if op == 'enter':
+                    self.transport.enter_room(sid, room)
+                else:
+                    self.transport.leave_room(sid, room)
+            for target, events in batch.take_frames():
+                self.transport.send_frame(target, events)
+        except Exception:
+            # Nobody is waiting on the pool's futures, so say so here instead of losing it
+            traceback.print_exc()
+
+        if self._done(actor):
+            self._schedule(actor)
+
+
+# Runs ticks as tasks on the event loop, for the asyncio server.
+# Same transport as ActorScheduler but with coroutine methods.
+class AsyncActorScheduler(BaseScheduler):
+    def __init__(self, transport, room_exists):
+        super().__init__(room_exists)
+        self.transport = transport
+        self._tasks = set()  # The loop only keeps weak references to tasks
+
+    def _schedule(self, actor):
+        task = asyncio.get_running_loop().create_task(self._run(actor))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, actor):
+        while True:
+            try:
+                batch = self._tick(actor)
+                for op, sid, room in batch.room_ops:
+                    if op == 'enter':
+                        await self.transport.enter_room(sid, room)
+                    else:
+                        await self.transport.leave_room(sid, room)
+                for target, events in batch.take_frames():
+                    await self.transport.send_frame(target, events)
+            except Exception:
+                traceback.print_exc()
+
+            if not self._done(actor):
+                return
+            await asyncio.sleep(0)  # Let other rooms and sockets have a turn
@@ -0,0 +1,173 @@
+from urllib.parse import parse_qs
+from actors import AsyncActorScheduler
+from metrics import MeteredJSON
+import game
+import json
+import os
+import socketio
+
+# asyncio version of server.py: python-socketio's AsyncServer under an ASGI server, so an idle
+# client costs a coroutine and a few buffers instead of a whole OS thread.
+#
+# Run with SERVER_MODE=asgi python server.py, or straight through uvicorn:
+#   uvicorn async_server:app --port 3000
+
+FRONTEND_ORIGIN = "http://localhost:5173"
+
+# Run each room as an actor that batches what it sends per tick (see actors.py), 0 to send per event
+ROOM_ACTORS = os.environ.get('ROOM_ACTORS', '1') == '1'
+
+# Message queue (e.g. redis://localhost:6379/0) so emits reach clients connected to other workers
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+client_manager = socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE else None
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins=[FRONTEND_ORIGIN], client_manager=client_manager,
+                          json=MeteredJSON(game.metrics) if game.METRICS else None)
+
+# How many sockets on this worker an emit to `to` (a socket ID or room) reaches
+def recipients(to):
+    return len(sio.manager.rooms.get('/', {}).get(to, ()))
+
+# Collects everything the game wants to send while it holds the room lock, then sends it
+# once the handler is done. The game code never awaits, so each event still runs start to
+# finish without another event getting in between.
+class Outbox:
+    def __init__(self):
+        self.ops = []
+
+    def emit(self, event, data, to):
+        self.ops.append((self._emit, (event, data, to), {}))
+
+    def enter_room(self, sid, room):
+        self.ops.append((sio.enter_room, (sid, room), {}))
+
+    def leave_room(self, sid, room):
+        self.ops.append((sio.leave_room, (sid, room), {}))
+
+    # Counted when it's sent, since a socket may enter the room earlier in the same handler
+    async def _emit(self, event, data, to):
+        game.metrics.emitted(event, recipients(to))
+        await sio.emit(event, data, to=to)
+
+    async def flush(self):
+        for func, args, kwargs in self.ops:
+            await func(*args, **kwargs)
+        self.ops.clear()
+
+# Sends a room actor's frames (see actors.py)
+class Transport:
+    async def enter_room(self, sid, room):
+        await sio.enter_room(sid, room)
+
+    async def leave_room(self, sid, room):
+        await sio.leave_room(sid, room)
+
+    async def send_frame(self, target, events):
+        game.metrics.emitted_frame(events, recipients(target))
+        await sio.emit('state_update', {'events': events}, to=target)
+
+scheduler = AsyncActorScheduler(Transport(), game.room_exists) if ROOM_ACTORS else None
+
+# Run a game handler straight away and send what it emitted
+async def run_now(handler, *args):
+    out = Outbox()
+    handler(*args, out)
+    await out.flush()
+
+@sio.on('connect')
+async def handle_connect(sid, environ, auth=None):
+    game.metrics.socket_connected()
+
+# Create a new game session or add a user to an existing one
+@sio.on('join')
+async def handle_join(sid, data):
+    if scheduler:
+        scheduler.submit_join(sid, data.get('session_id'), game.join, sid, data)
+    else:
+        await run_now(game.join, sid, data)
+
+# Handle receiving the answer
+@sio.on('check_answer')
+async def handle_check_answer(sid, data):
+    if scheduler:
+        scheduler.submit(data.get('session_id'), game.check_answer, sid, data)
+    else:
+        await run_now(game.check_answer, sid, data)
+
+# Handle user disconnection
+@sio.on('disconnect')
+async def handle_disconnect(sid, reason=None):
+    game.metrics.socket_disconnected()
+    if scheduler:
+        scheduler.submit_for_sid(sid, game.disconnect, sid)
+        scheduler.forget_sid(sid)
+    else:
+        await run_now(game.disconnect, sid)
+
+@sio.on('send_message')
+async def handle_send_message(sid, data):
+    if scheduler:
+        scheduler.submit(data.get('session_id'), game.send_message, sid, data)
+    else:
+        await run_now(game.send_message, sid, data)
+
+# Background task that sends pending leaderboard updates every LEADERBOARD_FLUSH_MS
+async def leaderboard_flusher():
+    while True:
+        await sio.sleep(game.LEADERBOARD_FLUSH_MS / 1000)
+        for room in game.take_dirty_leaderboards():
+            if scheduler:
+                scheduler.submit(room.session_id, game.flush_leaderboard, room)
+            else:
+                await run_now(game.flush_leaderboard, room)
+
+# Background task that drops rooms left empty for ROOM_IDLE_TTL
+async def room_sweeper():
+    while True:
+        await sio.sleep(1)
+        game.sweep_idle_rooms()
+
+def start_background_tasks():
+    if game.LEADERBOARD_FLUSH_MS > 0:
+        sio.start_background_task(leaderboard_flusher)
+    if game.ROOM_IDLE_TTL > 0:
+        sio.start_background_task(room_sweeper)
+
+async def send_json(send, status, body):
+    await send_body(send, status, b'application/json', json.dumps(body).encode())
+
+async def send_body(send, status, content_type, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type),
+            (b'access-control-allow-origin', FRONTEND_ORIGIN.encode()),
+            (b'access-control-allow-credentials', b'true'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+# The plain HTTP routes, /rooms, /route, /metrics and /profile, same as the Flask ones in server.py
+async def http_app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    path = scope['path'].rstrip('/')
+    if scope['method'] == 'GET' and path == '/rooms':
+        # Return the list of active session IDs, across all workers when the store is shared
+        await send_json(send, 200, game.room_ids())
+    elif scope['method'] == 'GET' and path == '/route':
+        query = parse_qs(scope.get('query_string', b'').decode())
+        session_id = query.get('session_id', [''])[0]
+        await send_json(send, 200, {'url': game.room_url(session_id)})
+    elif scope['method'] == 'GET' and path == '/metrics':
+        await send_body(send, 200, b'text/plain; version=0.0.4', game.metrics.render().encode())
+    elif scope['method'] == 'GET' and path == '/profile':
+        if game.profiler:
+            await send_body(send, 200, b'text/plain', game.profiler.collapsed().encode())
+        else:
+            await send_body(send, 404, b'text/plain', b'Profiling is off, set PROFILE_SAMPLE_MS to turn it on\n')
+    else:
+        await send_json(send, 404, {'error': 'Not found'})
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=start_background_tasks)
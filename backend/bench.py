@@ -0,0 +1,335 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+
+import socketio
+
+from loadtest import ORIGIN, wait_for_server
+
+# Latency benchmark for the socket protocol. Starts a server on localhost, connects simulated
+# players that join rooms, answer and chat at fixed rates, and reports:
+#   - answer -> leaderboard latency (p50/p95/p99): from sending check_answer to seeing your
+#     own new score in a leaderboard update
+#   - frames and bytes received per second, and events (inside frames) per second per event type
+#   - server RSS, and how much of it each room adds
+#
+# Results are written as JSON so runs can be compared, e.g.
+#   python bench.py --rooms 50 --players 8 --out before.json
+#   python bench.py --rooms 50 --players 8 --out after.json --compare before.json
+
+
+# One simulated player. Answers are always wrong, so the game never ends and every answer
+# changes the player's score by -50, which is how an update is matched to the answer behind it.
+class BenchPlayer:
+    def __init__(self, url, session_id, username):
+        self.session_id = session_id
+        self.username = username
+        self.player_id = None
+        self.question_id = None
+        self.score = None
+        self.expected_score = None
+        self.pending = deque()   # (sent at, score once the answer counts), oldest first
+        self.latencies = []
+        self.received = {}       # event -> [count, payload bytes], events inside frames counted separately
+        self.frames = [0, 0]     # Socket.IO messages received, [count, bytes]
+        self.handlers = {
+            'question': self.on_question,
+            'leaderboard': self.on_leaderboard,
+            'leaderboard_update': self.on_leaderboard_update,
+        }
+        self.client = socketio.Client(reconnection=False, websocket_extra_options={'origin': ORIGIN})
+        self.client.on('*', self.on_event)
+        self.client.on('state_update', self.on_state_update)
+        self.client.connect(url, transports=['websocket'])
+        self.client.emit('join', {'username': username, 'session_id': session_id})
+
+    @property
+    def ready(self):
+        return self.question_id is not None and self.player_id is not None
+
+    # Sizes are of the JSON payload, close to but not exactly what went over the wire
+    def count_frame(self, event, data):
+        self.frames[0] += 1
+        self.frames[1] += len(event) + len(json.dumps(data, separators=(',', ':')))
+
+    # Room actors batch several events into one frame
+    def on_state_update(self, data):
+        self.count_frame('state_update', data)
+        for event, payload in data['events']:
+            self.dispatch(event, payload)
+
+    def on_event(self, event, data):
+        self.count_frame(event, data)
+        self.dispatch(event, data)
+
+    def dispatch(self, event, data):
+        counts = self.received.get(event)
+        if counts is None:
+            counts = self.received[event] = [0, 0]
+        counts[0] += 1
+        counts[1] += len(json.dumps(data, separators=(',', ':')))
+
+        handler = self.handlers.get(event)
+        if handler:
+            handler(data)
+
+    def on_question(self, data):
+        self.question_id = data['question_id']
+
+    def on_leaderboard(self, data):
+        for player_id, username, score in data['leaderboard']:
+            if username == self.username:
+                self.player_id = player_id
+                self.saw_score(score)
+
+    def on_leaderboard_update(self, data):
+        for player_id, username, score, rank in data['changes']:
+            if player_id == self.player_id:
+                self.saw_score(score)
+
+    def saw_score(self, score):
+        now = time.perf_counter()
+        self.score = score
+        if self.expected_score is None:
+            self.expected_score = score
+        # Updates are coalesced, one score can cover several answers
+        while self.pending and self.pending[0][1] >= score:
+            self.latencies.append(now - self.pending.popleft()[0])
+
+    def answer(self):
+        self.expected_score -= 50
+        self.pending.append((time.perf_counter(), self.expected_score))
+        self.client.emit('check_answer', {
+            'session_id': self.session_id,
+            'username': self.username,
+            'question_id': self.question_id,
+            'answer': 'wrong',
+        })
+
+    def chat(self):
+        self.client.emit('send_message', {
+            'session_id': self.session_id,
+            'username': self.username,
+            'message': f'hello from {self.username}',
+        })
+
+    def reset(self):
+        self.latencies = []
+        self.received = {}
+        self.frames = [0, 0]
+
+
+# Runs in a child process: connects its share of the players, reports when they're all in,
+# waits for `go`, then drives answers and chat at the given rates for `duration` seconds
+def run_players(url, session_ids, players_per_room, answer_rate, chat_rate, duration, ready, go, results):
+    players = [BenchPlayer(url, session_id, f'{session_id}-p{i}')
+               for session_id in session_ids for i in range(players_per_room)]
+
+    deadline = time.time() + 30
+    while not all(player.ready for player in players) and time.time() < deadline:
+        time.sleep(0.05)
+    ready.put(len(players))
+    go.wait()
+    for player in players:
+        player.reset()
+
+    # Every player answers every 1/answer_rate and chats every 1/chat_rate seconds, staggered
+    # so they don't all fire at once
+    start = time.perf_counter()
+    end = start + duration
+    timers = []
+    for i, player in enumerate(players):
+        offset = i / len(players)
+        if answer_rate > 0:
+            timers.append((start + offset / answer_rate, i, 'answer', 1 / answer_rate))
+        if chat_rate > 0:
+            timers.append((start + offset / chat_rate, i, 'chat', 1 / chat_rate))
+    heapq.heapify(timers)
+
+    sent = {'answer': 0, 'chat': 0}
+    while timers:
+        due, i, action, interval = heapq.heappop(timers)
+        if due >= end:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        getattr(players[i], action)()
+        sent[action] += 1
+        heapq.heappush(timers, (due + interval, i, action, interval))
+
+    time.sleep(0.5)  # Let the last updates arrive
+    received = {}
+    for player in players:
+        for event, (count, size) in player.received.items():
+            totals = received.setdefault(event, [0, 0])
+            totals[0] += count
+            totals[1] += size
+    frames = [sum(player.frames[0] for player in players), sum(player.frames[1] for player in players)]
+    latencies = [latency for player in players for latency in player.latencies]
+    unanswered = sum(len(player.pending) for player in players)
+
+    for player in players:
+        player.client.disconnect()
+    results.put({'sent': sent, 'received': received, 'frames': frames, 'latencies': latencies, 'unanswered': unanswered})
+
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None  # Not Linux
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def start_server(port, mode, env_overrides):
+    env = dict(os.environ)
+    env.update(env_overrides)
+    env['PORT'] = str(port)
+    env['SERVER_MODE'] = mode
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    return subprocess.Popen([sys.executable, server], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run(args):
+    url = f'http://localhost:{args.port}'
+    server = start_server(args.port, args.mode, dict(item.split('=', 1) for item in args.server_env))
+    try:
+        wait_for_server(url)
+        idle_rss = rss_bytes(server.pid)
+
+        session_ids = [f'bench{i}' for i in range(args.rooms)]
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        go = multiprocessing.Event()
+        procs = [
+            multiprocessing.Process(target=run_players,
+                                    args=(url, session_ids[i::args.client_procs], args.players, args.answer_rate,
+                                          args.chat_rate, args.duration, ready, go, results))
+            for i in range(args.client_procs) if session_ids[i::args.client_procs]
+        ]
+        for proc in procs:
+            proc.start()
+        connected = sum(ready.get(timeout=120) for _ in procs)
+        loaded_rss = rss_bytes(server.pid)
+        go.set()
+
+        reports = [results.get(timeout=args.duration + 120) for _ in procs]
+        peak_rss = rss_bytes(server.pid)
+        for proc in procs:
+            proc.join()
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    latencies = [latency for report in reports for latency in report['latencies']]
+    received = {}
+    for report in reports:
+        for event, (count, size) in report['received'].items():
+            totals = received.setdefault(event, [0, 0])
+            totals[0] += count
+            totals[1] += size
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'mode': args.mode,
+            'rooms': args.rooms,
+            'players_per_room': args.players,
+            'answer_rate': args.answer_rate,
+            'chat_rate': args.chat_rate,
+            'duration': args.duration,
+            'client_procs': args.client_procs,
+            'server_env': args.server_env,
+        },
+        'players_connected': connected,
+        'answers_sent_per_sec': round(sum(r['sent']['answer'] for r in reports) / args.duration, 1),
+        'messages_sent_per_sec': round(sum(r['sent']['chat'] for r in reports) / args.duration, 1),
+        'answer_to_leaderboard_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(max(latencies) if latencies else None),
+            'samples': len(latencies),
+            'unanswered': sum(report['unanswered'] for report in reports),
+        },
+        'received_per_sec': {
+            'frames': round(sum(report['frames'][0] for report in reports) / args.duration, 1),
+            'bytes': round(sum(report['frames'][1] for report in reports) / args.duration, 1),
+            'events': round(sum(count for count, size in received.values()) / args.duration, 1),
+            'by_event': {event: {'events': round(count / args.duration, 1), 'bytes': round(size / args.duration, 1)}
+                         for event, (count, size) in sorted(received.items())},
+        },
+        'server_rss_bytes': {
+            'idle': idle_rss,
+            'loaded': loaded_rss,
+            'peak': peak_rss,
+            'per_room': (peak_rss - idle_rss) // args.rooms if idle_rss and peak_rss else None,
+        },
+    }
+
+
+# Flatten nested results to {'a.b.c': number} for comparing two runs
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, results):
+    before, after = flatten(baseline), flatten(results)
+    print(f"{'metric':<48} {'before':>14} {'after':>14} {'change':>9}")
+    for key in sorted(before.keys() & after.keys()):
+        if key.startswith('config.'):
+            continue
+        change = f'{(after[key] - before[key]) / before[key] * 100:+.1f}%' if before[key] else ''
+        print(f'{key:<48} {before[key]:>14} {after[key]:>14} {change:>9}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure answer -> leaderboard latency and throughput on localhost')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--players', type=int, default=4, help='Players per room')
+    parser.add_argument('--answer-rate', type=float, default=1, help='Answers per second per player')
+    parser.add_argument('--chat-rate', type=float, default=0.2, help='Chat messages per second per player')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to measure for')
+    parser.add_argument('--mode', choices=['asgi', 'threading'], default='asgi',
+                        help='SERVER_MODE to start')
+    parser.add_argument('--server-env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Extra environment for the server, e.g. ROOM_ACTORS=0 (repeatable)')
+    parser.add_argument('--client-procs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--port', type=int, default=3200)
+    parser.add_argument('--out', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Earlier results file to compare against')
+    args = parser.parse_args()
+
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,65 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import zlib
+
+
+# Which worker a room lives on. crc32 rather than hash() so every process agrees.
+def worker_for_room(session_id, worker_count):
+    return zlib.crc32(str(session_id).encode('utf-8')) % worker_count
+
+
+# Start one server.py per worker on consecutive ports.
+#
+# Every worker shares the same state store so /rooms on any of them lists every room, and a
+# join that lands on the wrong worker is redirected to the worker that owns the room, so each
+# room's state only ever lives in one process. server_mode is passed on as SERVER_MODE.
+def start_workers(count, base_port=3000, store=None, message_queue=None, server_mode=None, quiet=False):
+    urls = [f'http://localhost:{base_port + i}' for i in range(count)]
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+    workers = []
+    for i in range(count):
+        env = dict(os.environ)
+        env['PORT'] = str(base_port + i)
+        env['WORKER_ID'] = str(i)
+        env['WORKER_URLS'] = ','.join(urls)
+        if store:
+            env['STATE_STORE'] = store
+        if message_queue:
+            env['SOCKETIO_MESSAGE_QUEUE'] = message_queue
+        if server_mode:
+            env['SERVER_MODE'] = server_mode
+        output = subprocess.DEVNULL if quiet else None
+        workers.append(subprocess.Popen([sys.executable, server], env=env, stdout=output, stderr=output))
+    return workers, urls
+
+
+def stop_workers(workers):
+    for worker in workers:
+        worker.send_signal(signal.SIGINT)
+    for worker in workers:
+        try:
+            worker.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several game server workers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--base-port', type=int, default=3000)
+    parser.add_argument('--store', default='sqlite:///game_state.db', help='State store shared by the workers')
+    parser.add_argument('--message-queue', default=None, help='e.g. redis://localhost:6379/0')
+    parser.add_argument('--mode', choices=['threading', 'asgi'], default=None, help='SERVER_MODE for the workers')
+    args = parser.parse_args()
+
+    workers, urls = start_workers(args.workers, args.base_port, args.store, args.message_queue, args.mode)
+    print('Workers:', ', '.join(urls))
+    try:
+        for worker in workers:
+            worker.wait()
+    except KeyboardInterrupt:
+        stop_workers(workers)
@@ -0,0 +1,381 @@
+from questions import Deck, QuestionBank, canonical_answer
+from cluster import worker_for_room
+from metrics import Metrics, SamplingProfiler
+from persistence import JournaledStore, Persistence
+from sessions import SessionRegistry
+from state_store import create_store
+import atexit
+import os
+import threading
+import time
+
+# The game itself, shared by the threading server (server.py) and the asyncio one (async_server.py).
+#
+# Nothing in here talks to sockets directly. Every handler gets an `out` object with
+#   out.emit(event, data, to)    send to one socket ID or a whole room
+#   out.enter_room(sid, room)    put a socket in a room
+#   out.leave_room(sid, room)
+# and the server decides whether that sends right away or queues it up to send later.
+
+# This worker's index, and the URL of every worker when rooms are pinned to workers (set by cluster.py)
+WORKER_ID = int(os.environ['WORKER_ID']) if os.environ.get('WORKER_ID') else None
+WORKER_URLS = [url for url in os.environ.get('WORKER_URLS', '').split(',') if url]
+
+# Where room state is published, "memory" or "sqlite:///path" to share it between workers
+STATE_STORE = os.environ.get('STATE_STORE', 'memory')
+
+# Database of questions
+QUESTIONS_DB = {
+    0: {"question": "What's 5 + 7?", "answer": "12"},
+    1: {"question": "What's 25 / 5?", "answer": "5"},
+    2: {"question": "What's 10 * 2?", "answer": "20"},
+    3: {"question": "What's 15 - 3?", "answer": "12"},
+    4: {"question": "What's 20 + 10?", "answer": "30"},
+}
+
+# Question bank file to load at startup (.json, .csv or .sqlite), QUESTIONS_DB is used if not set
+QUESTION_BANK = os.environ.get('QUESTION_BANK')
+
+# Set to 'generated' to make up arithmetic questions instead of using the bank
+QUESTION_SOURCE = os.environ.get('QUESTION_SOURCE', 'bank')
+
+# Load all the questions once, rooms draw from this through their own decks
+question_bank = QuestionBank().load(QUESTION_BANK) if QUESTION_BANK else QuestionBank().load_dict(QUESTIONS_DB)
+
+# Max number of messages kept per room, older ones fall off the front of the buffer
+MAX_ROOM_MESSAGES = int(os.environ.get('MAX_ROOM_MESSAGES', 200))
+
+# Leaderboard changes within this window are sent as one update (0 sends every change right away)
+LEADERBOARD_FLUSH_MS = int(os.environ.get('LEADERBOARD_FLUSH_MS', 100))
+
+# How many of the top players to include with each leaderboard update (0 to leave it out)
+LEADERBOARD_TOP_N = int(os.environ.get('LEADERBOARD_TOP_N', 10))
+
+# Directory to keep an event log and snapshots in, so games survive a restart (see persistence.py).
+# Not set means rooms only live in memory.
+PERSIST_DIR = os.environ.get('PERSIST_DIR')
+if PERSIST_DIR and WORKER_ID is not None:
+    PERSIST_DIR = os.path.join(PERSIST_DIR, f'worker-{WORKER_ID}')
+
+# How often the event log is written and fsynced. Everything from one window goes in one write.
+PERSIST_FSYNC_MS = int(os.environ.get('PERSIST_FSYNC_MS', 50))
+
+# How often to write a snapshot and throw away the log before it (0 for only at startup)
+SNAPSHOT_INTERVAL_S = float(os.environ.get('SNAPSHOT_INTERVAL_S', 60))
+
+# How long an empty room (and the scores in it) is kept for players to reconnect to.
+# 0 drops a room as soon as the last player leaves.
+ROOM_IDLE_TTL = float(os.environ.get('ROOM_IDLE_TTL', 300 if PERSIST_DIR else 0))
+
+# Collect handler timings, emit counts and gauges for /metrics (0 to turn it all off)
+METRICS = os.environ.get('METRICS', '1') == '1'
+
+# Sample every thread's stack this often and serve the counts at /profile (0 for off)
+PROFILE_SAMPLE_MS = int(os.environ.get('PROFILE_SAMPLE_MS', 0))
+
+metrics = Metrics(enabled=METRICS)
+profiler = SamplingProfiler(PROFILE_SAMPLE_MS / 1000) if PROFILE_SAMPLE_MS > 0 else None
+if profiler:
+    profiler.start()
+
+# In-memory game sessions (keyed by session ID), plus which room each socket is in
+store = create_store(STATE_STORE)
+store.delete_worker_rooms(WORKER_ID)  # Anything left over from this worker's last run is gone
+atexit.register(store.close)  # Write out whatever the store still has queued
+persistence = None
+if PERSIST_DIR:
+    persistence = Persistence(PERSIST_DIR, fsync_ms=PERSIST_FSYNC_MS, snapshot_interval=SNAPSHOT_INTERVAL_S,
+                              max_messages=MAX_ROOM_MESSAGES)
+    store = JournaledStore(store, persistence.log)
+registry = SessionRegistry(max_messages=MAX_ROOM_MESSAGES, store=store, worker=WORKER_ID, idle_ttl=ROOM_IDLE_TTL)
+
+# Put back the rooms from the last run. Players get their scores back by rejoining the same
+# session with the same username.
+def recover():
+    for session_id, saved in persistence.recovered.items():
+        info = saved['info']
+        room = registry.restore(session_id, info, [(player_id, username, score) for player_id, (username, score)
+                                                   in saved['players'].items()],
+                                saved['messages'], saved['next_seq'])
+        room.deck = Deck(question_bank, category=info.get('category'), difficulty=info.get('difficulty'),
+                         procedural=info.get('procedural', False),
+                         next_generated_id=info.get('next_generated_id', -1))
+        room.save()
+
+    # Start the new run from a snapshot rather than the whole old log
+    persistence.recovered = None
+    persistence.snapshot(registry)
+    persistence.start(registry)
+    atexit.register(persistence.stop)
+
+if persistence:
+    recover()
+
+metrics.gauge('game_rooms', 'Rooms on this worker', lambda: len(registry.room_ids()))
+metrics.gauge('game_players', 'Players connected to a room',
+              lambda: sum(len(room.players) for room in registry.rooms()))
+metrics.gauge('game_room_messages', "Messages in each room's history",
+              lambda: {'label': 'room', 'values': {room.session_id: len(room.messages) for room in registry.rooms()}})
+
+# Drop rooms that have sat empty for ROOM_IDLE_TTL. Servers call this about once a second.
+def sweep_idle_rooms():
+    registry.sweep()
+
+# Active session IDs, across all workers when the store is shared
+def room_ids():
+    return store.room_ids()
+
+# Whether this process is running a room
+def room_exists(session_id):
+    return registry.get(session_id) is not None
+
+# The worker that owns a room, or None if rooms aren't pinned to workers
+def room_owner(session_id):
+    if not WORKER_URLS:
+        return None
+    return worker_for_room(session_id, len(WORKER_URLS))
+
+# URL of the server a client should connect to for a room, or None if any will do
+def room_url(session_id):
+    owner = room_owner(session_id)
+    return WORKER_URLS[owner] if owner is not None else None
+
+# Create a new game session or add a user to an existing one
+@metrics.timed('join')
+def join(sid, data, out):
+    username = data['username']
+    session_id = data['session_id']
+
+    if session_id and username:
+        # This room lives on another worker, send the client there instead
+        owner = room_owner(session_id)
+        if owner is not None and owner != WORKER_ID:
+            out.emit('redirect', {'url': WORKER_URLS[owner], 'session_id': session_id}, sid)
+            return
+
+        room, _, left = registry.join(sid, username, session_id)
+        if left:
+            # This socket was in another room before, tell that room it's gone
+            out.leave_room(sid, left[0].session_id)
+            announce_leave(*left, out)
+
+        out.enter_room(sid, session_id)  # Join the user to the session room
+
+        with room.lock:
+            # First one in picks the question filters for the room
+            if room.deck is None:
+                room.deck = Deck(question_bank,
+                                 category=data.get('category'),
+                                 difficulty=data.get('difficulty'),
+                                 procedural=QUESTION_SOURCE == 'generated')
+
+            out.emit('joined', {'message': f'Welcome {username}! You are now in session {session_id}.'}, session_id)
+
+            # Only send the joining user the messages they haven't seen yet.
+            # A fresh client sends no cursor (or 0) and gets whatever is still in the buffer, and so
+            # does one whose cursor is from an earlier run of the room (its seqs have started over).
+            try:
+                last_seq = int(data.get('last_seq') or 0)
+            except (TypeError, ValueError):
+                last_seq = 0
+            if data.get('epoch') != room.epoch:
+                last_seq = 0
+            out.emit('room_messages', {
+                'messages': messages_since(room, last_seq),
+                'last_seq': room.next_seq - 1,
+                'epoch': room.epoch,
+            }, sid)
+
+            # Add a "user joined" message to the room messages
+            add_room_message(room, None, f'{username} has joined the game!', out)
+
+            # The new user gets the whole board once, everyone else just gets the change
+            out.emit('leaderboard', {'leaderboard': room.leaderboard.top()}, sid)
+            send_leaderboard(room, out)
+
+            # The game is over, there's nothing left to answer
+            if room.current_question_num > room.question_total_num:
+                out.emit('game_end', {'message': 'Game ended!'}, sid)
+            # Send the current question to the new user if one exists
+            elif room.current_question:
+                out.emit('question', room.current_question, sid)
+            else:
+                # If no question exists, generate a new one
+                send_random_question(room, out)
+    else:
+        metrics.count('game_invalid_events_total', 'join')
+        print("Invalid join data:", data)
+
+# Append a message to the room history and broadcast just that message
+def add_room_message(room, username, message, out):
+    entry = {
+        'seq': room.next_seq,
+        'username': username,
+        'message': message,
+        'timestamp': str(int(time.time() * 1000)),
+    }
+    room.next_seq += 1
+    room.messages.append(entry)  # deque drops the oldest message once it's full
+    room.store.append_message(room.session_id, entry, room.messages.maxlen)
+
+    out.emit('new_message', entry, room.session_id)
+    return entry
+
+# Get the messages in a room's history newer than the given sequence number
+def messages_since(room, last_seq):
+    history = room.messages
+    if not history or last_seq >= history[-1]['seq']:
+        return []
+
+    # Sequence numbers are contiguous inside the buffer, so we can jump straight to the first missed one
+    start = max(last_seq - history[0]['seq'] + 1, 0)
+    if start == 0:
+        return list(history)
+    return [history[i] for i in range(start, len(history))]
+
+# Function to send the next question from the room's deck
+def send_random_question(room, out):
+    question_id, question_text, answer = room.deck.draw()
+
+    room.current_question = {
+        'question_id': question_id,
+        'question_text': question_text
+    }
+    room.current_answer = answer
+    room.save()
+
+
+    # Send the question to the users in the session
+    out.emit('question',
+             {'question_id': question_id,
+              'question_text': question_text,
+              'question_total_num': room.question_total_num,
+              'current_question_num': room.current_question_num
+              },
+             room.session_id)
+
+
+# Handle receiving the answer
+@metrics.timed('check_answer')
+def check_answer(sid, data, out):
+    session_id = data['session_id']
+    user_answer = data['answer']
+    question_id = data['question_id']
+
+    room = registry.get(session_id)
+    if room is None:
+        return
+
+    # Hold the room lock for the whole check so two answers can't both score or
+    # both advance current_question_num
+    with room.lock:
+        player = room.players.get(sid)  # User who is answering
+        if player is None:
+            return
+        username = player.username
+
+        if room.current_question_num > room.question_total_num:
+            return
+
+        # Someone else already answered this question and we've moved on
+        if room.current_question is None or room.current_question['question_id'] != question_id:
+            out.emit('answer_result', {'status': 'too_late', 'username': username}, sid)
+            return
+
+        if canonical_answer(user_answer) == room.current_answer:
+            room.current_question_num += 1
+            # Correct answer: add 100 points
+            room.add_score(player, 100)
+            result_status = 'correct'
+            if room.current_question_num <= room.question_total_num:
+                send_random_question(room, out)
+            else:
+                room.current_question = room.current_answer = None
+                room.save()
+                out.emit('game_end', {'message': 'Game ended!'}, sid)
+        else:
+            # Incorrect answer: subtract 50 points
+            room.add_score(player, -50)
+            result_status = 'incorrect'
+
+        # Save the result message to room messages
+        add_room_message(room, username, f'{username} got the answer {result_status}!', out)
+
+        # Emit the result to the user who answered
+        out.emit('answer_result', {
+            'status': result_status,
+            'username': username  # Send the username of the person who answered
+        }, session_id)
+
+        # Send updated leaderboard
+        send_leaderboard(room, out)
+
+
+# Rooms with leaderboard changes waiting to be sent
+dirty_leaderboards = set()
+dirty_leaderboards_lock = threading.Lock()
+
+# Function to send the updated leaderboard.
+# Changes are batched up and sent by the server's flusher task (see take_dirty_leaderboards),
+# so a burst of answers is one update.
+def send_leaderboard(room, out):
+    if LEADERBOARD_FLUSH_MS <= 0:
+        flush_leaderboard(room, out)
+        return
+
+    with dirty_leaderboards_lock:
+        dirty_leaderboards.add(room)
+
+# Send the ranks and scores that changed since the last update, plus the top N
+def flush_leaderboard(room, out):
+    with room.lock:
+        if not room.leaderboard.has_changes():
+            return
+        changes, removed = room.leaderboard.changes()
+        update = {'changes': changes, 'removed': removed}
+        if LEADERBOARD_TOP_N > 0:
+            update['top'] = room.leaderboard.top(LEADERBOARD_TOP_N)
+        out.emit('leaderboard_update', update, room.session_id)
+
+# Rooms with leaderboard changes since the last flush. Servers call this every LEADERBOARD_FLUSH_MS
+# and run flush_leaderboard for each one.
+def take_dirty_leaderboards():
+    with dirty_leaderboards_lock:
+        rooms = list(dirty_leaderboards)
+        dirty_leaderboards.clear()
+    return rooms
+
+# Tell the rest of a room that a player has left
+def announce_leave(room, player, now_empty, out):
+    # Nobody left to tell, the registry has already dropped the room
+    if player is None or now_empty:
+        return
+
+    with room.lock:
+        out.emit('user_left', {'message': f'{player.username} has left the game.'}, room.session_id)
+        add_room_message(room, player.username, f'{player.username} has left the game.', out)
+        send_leaderboard(room, out)
+
+# Handle user disconnection
+@metrics.timed('disconnect')
+def disconnect(sid, out):
+    # Look up the user's room from the socket ID, no need to search every session
+    left = registry.leave(sid)
+    if left:
+        announce_leave(*left, out)
+
+@metrics.timed('send_message')
+def send_message(sid, data, out):
+    session_id = data['session_id']
+    username = data['username']
+    message = data['message']
+
+    room = registry.get(session_id)
+    if room is not None:
+        with room.lock:
+            player = room.players.get(sid)
+            if player is not None:
+                username = player.username
+
+            # Save the message in the session's message history and send it to all users in the session
+            add_room_message(room, username, message, out)
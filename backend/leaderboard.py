@@ -0,0 +1,207 @@
+import itertools
+import random
+
+# Most levels a skip list node can have, plenty for any room size
+MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.width = [1] * level  # How many positions following next[i] moves forward
+
+
+# Sorted keys in an indexable skip list: insert, remove and finding a key's rank are all
+# O(log n) expected, and walking forward from any rank is O(log n) plus the walk.
+# Positions count from 1, the head sits at position 0 and None is at position len + 1.
+class RankedList:
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVEL)
+        self._level = 1   # Levels in use
+        self._size = 0
+        self._random = random.Random()
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        # Each extra level with probability 1/2
+        bits = self._random.getrandbits(MAX_LEVEL - 1)
+        level = 1
+        while bits & 1:
+            level += 1
+            bits >>= 1
+        return level
+
+    # Last node before `key` on every level, and its position
+    def _find(self, key, levels):
+        update = [None] * levels
+        positions = [0] * levels
+        node = self._head
+        position = 0
+        for i in reversed(range(levels)):
+            following = node.next[i]
+            while following is not None and following.key < key:
+                position += node.width[i]
+                node = following
+                following = node.next[i]
+            update[i] = node
+            positions[i] = position
+        return update, positions
+
+    # Insert a key, returns its 0-based rank
+    def insert(self, key):
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                self._head.next[i] = None
+                self._head.width[i] = self._size + 1
+            self._level = level
+        update, positions = self._find(key, self._level)
+
+        node = _Node(key, level)
+        position = positions[0] + 1
+        for i in range(level):
+            before = update[i]
+            node.next[i] = before.next[i]
+            before.next[i] = node
+            node.width[i] = before.width[i] + positions[i] + 1 - position
+            before.width[i] = position - positions[i]
+        for i in range(level, self._level):
+            update[i].width[i] += 1
+        self._size += 1
+        return position - 1
+
+    # Remove a key that's in the list, returns the 0-based rank it had
+    def remove(self, key):
+        update, positions = self._find(key, self._level)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self._level):
+            before = update[i]
+            if i < len(node.next):
+                before.width[i] += node.width[i] - 1
+                before.next[i] = node.next[i]
+            else:
+                before.width[i] -= 1
+        self._size -= 1
+        return positions[0]
+
+    # 0-based rank of a key that's in the list
+    def rank(self, key):
+        return self._find(key, self._level)[1][0]
+
+    # Keys from 0-based rank `start`, at most `count` of them (None for all the rest)
+    def iter_from(self, start, count=None):
+        if start >= self._size:
+            return
+        target = start + 1
+        node = self._head
+        position = 0
+        for i in reversed(range(self._level)):
+            while node.next[i] is not None and position + node.width[i] <= target:
+                position += node.width[i]
+                node = node.next[i]
+        while node is not None and (count is None or count > 0):
+            yield node.key
+            node = node.next[0]
+            if count is not None:
+                count -= 1
+
+
+# Ranked scores for one room, kept sorted as scores change so we never re-sort the whole room.
+#
+# Entries are (-score, tiebreak, player_id) keys in a RankedList, so a score change is an
+# O(log n) remove and insert. Among equal scores whoever got there first ranks higher.
+#
+# Changes are tracked between broadcasts so we only send the rows whose rank, score or
+# username moved.
+class Leaderboard:
+    def __init__(self):
+        self._entries = RankedList()  # (-score, tiebreak, player_id)
+        self._players = {}     # player_id -> [key, username]
+        self._tiebreak = itertools.count()
+
+        self._sent = {}        # player_id -> (rank, score, username) as of the last broadcast
+        self._removed = set()  # Players removed since the last broadcast
+        self._dirty_lo = None  # Range of ranks that may have changed since the last broadcast
+        self._dirty_hi = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _mark_dirty(self, lo, hi):
+        if self._dirty_lo is None:
+            self._dirty_lo, self._dirty_hi = lo, hi
+        else:
+            self._dirty_lo = min(self._dirty_lo, lo)
+            self._dirty_hi = max(self._dirty_hi, hi)
+
+    # Add a player or change their score or name
+    def set(self, player_id, username, score):
+        old_rank = None
+        record = self._players.get(player_id)
+        if record is not None:
+            old_key, old_username = record
+            if old_key[0] == -score:
+                if old_username != username:
+                    record[1] = username
+                    rank = self._entries.rank(old_key)
+                    self._mark_dirty(rank, rank)
+                return
+            old_rank = self._entries.remove(old_key)
+
+        key = (-score, next(self._tiebreak), player_id)
+        new_rank = self._entries.insert(key)
+        self._players[player_id] = [key, username]
+        self._removed.discard(player_id)
+
+        if old_rank is None:
+            # Everyone below the new player moved down one
+            self._mark_dirty(new_rank, len(self._entries) - 1)
+        else:
+            self._mark_dirty(min(old_rank, new_rank), max(old_rank, new_rank))
+
+    def remove(self, player_id):
+        record = self._players.pop(player_id, None)
+        if record is None:
+            return
+        rank = self._entries.remove(record[0])
+        if player_id in self._sent:
+            self._removed.add(player_id)
+        # Everyone below them moved up one
+        self._mark_dirty(rank, len(self._entries) - 1)
+
+    # [player_id, username, score] rows in rank order, optionally just the first n
+    def top(self, n=None):
+        return [[player_id, self._players[player_id][1], -neg_score]
+                for neg_score, _, player_id in self._entries.iter_from(0, n)]
+
+    def has_changes(self):
+        return self._dirty_lo is not None or bool(self._removed)
+
+    # Everything that changed since the last call, as [player_id, username, score, rank] rows
+    # plus the IDs of players who were removed. Resets the change tracking.
+    def changes(self):
+        changed = []
+        if self._dirty_lo is not None and self._dirty_lo < len(self._entries):
+            count = min(self._dirty_hi, len(self._entries) - 1) - self._dirty_lo + 1
+            for rank, (neg_score, _, player_id) in enumerate(self._entries.iter_from(self._dirty_lo, count),
+                                                              self._dirty_lo):
+                score = -neg_score
+                username = self._players[player_id][1]
+                if self._sent.get(player_id) != (rank, score, username):
+                    self._sent[player_id] = (rank, score, username)
+                    changed.append([player_id, username, score, rank])
+
+        removed = list(self._removed)
+        for player_id in removed:
+            self._sent.pop(player_id, None)
+
+        self._removed.clear()
+        self._dirty_lo = self._dirty_hi = None
+        return changed, removed
@@ -0,0 +1,146 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import urllib.request
+
+import socketio
+
+from cluster import start_workers, stop_workers, worker_for_room
+
+# The server only accepts sockets from the frontend's origin, so the fake players claim to be it
+ORIGIN = 'http://localhost:5173'
+
+
+# One simulated player. Answers (always wrong, so the game never ends) as soon as it
+# hears back about its previous answer, so each player is one answer in flight at a time.
+class Player:
+    def __init__(self, url, session_id, username):
+        self.session_id = session_id
+        self.username = username
+        self.question_id = None
+        self.answers = 0
+        self.running = True
+        self.client = socketio.Client(reconnection=False, websocket_extra_options={'origin': ORIGIN})
+        self.handlers = {'question': self.on_question, 'answer_result': self.on_answer_result}
+        for event, handler in self.handlers.items():
+            self.client.on(event, handler)
+        self.client.on('state_update', self.on_state_update)
+        self.client.connect(url, transports=['websocket'])
+        self.client.emit('join', {'username': username, 'session_id': session_id})
+
+    # Room actors batch several events into one frame
+    def on_state_update(self, data):
+        for event, payload in data['events']:
+            handler = self.handlers.get(event)
+            if handler:
+                handler(payload)
+
+    def on_question(self, data):
+        first = self.question_id is None
+        self.question_id = data['question_id']
+        if first:
+            self.answer()
+
+    def on_answer_result(self, data):
+        if data['username'] != self.username:
+            return
+        self.answers += 1
+        if self.running:
+            self.answer()
+
+    def answer(self):
+        self.client.emit('check_answer', {
+            'session_id': self.session_id,
+            'username': self.username,
+            'question_id': self.question_id,
+            'answer': 'wrong',
+        })
+
+
+# Runs in a child process so the clients aren't all fighting over one GIL
+def run_players(urls, session_ids, players_per_room, duration, results):
+    players = []
+    for session_id in session_ids:
+        url = urls[worker_for_room(session_id, len(urls))]
+        for i in range(players_per_room):
+            players.append(Player(url, session_id, f'{session_id}-p{i}'))
+
+    # Wait for everyone to start answering, then count answers over the window
+    deadline = time.time() + 10
+    while any(player.question_id is None for player in players) and time.time() < deadline:
+        time.sleep(0.05)
+    start = [player.answers for player in players]
+    time.sleep(duration)
+    end = [player.answers for player in players]
+
+    for player in players:
+        player.running = False
+        player.client.disconnect()
+    results.put(sum(end) - sum(start))
+
+
+def wait_for_server(url, timeout=20):
+    host, port = url.rsplit('/', 1)[-1].split(':')
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, int(port)), timeout=1):
+                urllib.request.urlopen(url + '/rooms', timeout=2).read()
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} never came up')
+
+
+# Answers per second handled by a cluster of `workers` processes
+def measure(workers, rooms, players_per_room, duration, client_procs, base_port, store, server_mode=None):
+    processes, urls = start_workers(workers, base_port, store=store, server_mode=server_mode, quiet=True)
+    try:
+        for url in urls:
+            wait_for_server(url)
+
+        session_ids = [f'load{i}' for i in range(rooms)]
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=run_players,
+                                    args=(urls, session_ids[i::client_procs], players_per_room, duration, results))
+            for i in range(client_procs) if session_ids[i::client_procs]
+        ]
+        for proc in procs:
+            proc.start()
+        total = sum(results.get(timeout=duration + 60) for _ in procs)
+        for proc in procs:
+            proc.join()
+        return total / duration
+    finally:
+        stop_workers(processes)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare answer throughput across worker counts')
+    parser.add_argument('--workers', default='1,4', help='Comma separated worker counts to try')
+    parser.add_argument('--rooms', type=int, default=16)
+    parser.add_argument('--players', type=int, default=4, help='Players per room')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to measure for')
+    parser.add_argument('--client-procs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--base-port', type=int, default=3100)
+    parser.add_argument('--mode', choices=['threading', 'asgi'], default=None, help='SERVER_MODE for the workers')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in [int(n) for n in args.workers.split(',')]:
+            store = f"sqlite:///{os.path.join(tmp, f'state{workers}.db')}"
+            throughput = measure(workers, args.rooms, args.players, args.duration,
+                                 args.client_procs, args.base_port, store, args.mode)
+            results.append({'workers': workers, 'answers_per_sec': round(throughput, 1)})
+            print(f'{workers} worker(s): {throughput:.1f} answers/s')
+
+    baseline = results[0]['answers_per_sec']
+    for result in results:
+        result['speedup'] = round(result['answers_per_sec'] / baseline, 2) if baseline else None
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,237 @@
+from bisect import bisect_left
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Counters, histograms and gauges for the game server, rendered in the Prometheus text format
+# for the /metrics route. Everything on the hot path is a lock and a few integer adds, so it's
+# cheap enough to leave on. Gauges are only worked out when /metrics is asked for.
+
+# Handler latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.handlers = {}     # event -> Histogram of handler time
+        self.emits = {}        # event -> [emits, recipients, payload bytes]
+        self.counters = {}     # (name, event) -> count, for anything else worth counting
+        self.sockets = 0
+        self.gauges = []       # (name, help, fn), see gauge()
+        self._lock = threading.Lock()
+
+    # Decorator recording how long a game handler takes, e.g. @metrics.timed('join')
+    def timed(self, event):
+        def decorate(handler):
+            if not self.enabled:
+                return handler
+
+            histogram = self.handlers[event] = Histogram()
+
+            @functools.wraps(handler)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return handler(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    with self._lock:
+                        histogram.observe(elapsed)
+            return wrapper
+        return decorate
+
+    def _counts(self, event):
+        counts = self.emits.get(event)
+        if counts is None:
+            counts = self.emits[event] = [0, 0, 0]
+        return counts
+
+    # An event was sent to `recipients` sockets
+    def emitted(self, event, recipients):
+        if not self.enabled:
+            return
+        with self._lock:
+            counts = self._counts(event)
+            counts[0] += 1
+            counts[1] += recipients
+
+    # A room actor's 'state_update' frame of [event, data] pairs was sent to `recipients` sockets.
+    # Counted as the frame plus each event in it.
+    def emitted_frame(self, events, recipients):
+        if not self.enabled:
+            return
+        with self._lock:
+            counts = self._counts('state_update')
+            counts[0] += 1
+            counts[1] += recipients
+            for event, data in events:
+                counts = self._counts(event)
+                counts[0] += 1
+                counts[1] += recipients
+
+    # An event's payload was encoded to `size` bytes (once per emit, however many it goes to)
+    def encoded(self, event, size):
+        with self._lock:
+            self._counts(event)[2] += size
+
+    def count(self, name, event):
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (name, event)
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def socket_connected(self):
+        with self._lock:
+            self.sockets += 1
+
+    def socket_disconnected(self):
+        with self._lock:
+            self.sockets -= 1
+
+    # Register a gauge worked out at scrape time. fn returns a number, or
+    # {'label': label name, 'values': {label value: number}} for one series per label value.
+    def gauge(self, name, help, fn):
+        self.gauges.append((name, help, fn))
+
+    # Everything in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self._lock:
+            handlers = {event: (list(h.counts), h.sum, h.count, h.buckets) for event, h in self.handlers.items()}
+            emits = {event: list(counts) for event, counts in self.emits.items()}
+            counters = dict(self.counters)
+            sockets = self.sockets
+
+        lines.append('# HELP game_handler_seconds Time spent handling each socket event')
+        lines.append('# TYPE game_handler_seconds histogram')
+        for event, (counts, total, count, buckets) in sorted(handlers.items()):
+            cumulative = 0
+            for bound, n in zip(buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'game_handler_seconds_bucket{{event="{event}",le="{le}"}} {cumulative}')
+            lines.append(f'game_handler_seconds_sum{{event="{event}"}} {total}')
+            lines.append(f'game_handler_seconds_count{{event="{event}"}} {count}')
+
+        for index, (name, help) in enumerate((
+                ('game_emits_total', 'Events sent, counting a room broadcast once'),
+                ('game_emit_recipients_total', 'Sockets events were sent to (fan-out)'),
+                ('game_emit_payload_bytes_total', 'Encoded payload bytes, once per emit'))):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} counter')
+            for event, counts in sorted(emits.items()):
+                lines.append(f'{name}{{event="{event}"}} {counts[index]}')
+
+        for name in sorted({name for name, event in counters}):
+            lines.append(f'# TYPE {name} counter')
+            for (counter, event), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{name}{{event="{event}"}} {value}')
+
+        lines.append('# HELP game_sockets Connected sockets')
+        lines.append('# TYPE game_sockets gauge')
+        lines.append(f'game_sockets {sockets}')
+
+        for name, help, fn in self.gauges:
+            value = fn()
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            if isinstance(value, dict):
+                label, values = value['label'], value['values']
+                for key, number in sorted(values.items()):
+                    lines.append(f'{name}{{{label}="{_label(key)}"}} {number}')
+            else:
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Drop-in for the json module that python-socketio encodes packets with (its `json` option).
+# Counts each event's encoded size while it's being encoded anyway, so nothing is serialized
+# twice. A room actor's 'state_update' frame is put together from its events encoded one by one,
+# so their sizes are counted under their own names; 'state_update' itself only gets the wrapper.
+class MeteredJSON:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        if type(obj) is not list or not obj or type(obj[0]) is not str:
+            return json.dumps(obj, **kwargs)  # Engine.IO handshakes and the like
+
+        event = obj[0]
+        if event == 'state_update' and len(obj) == 2:
+            parts = [json.dumps(item, **kwargs) for item in obj[1]['events']]
+            for (name, data), part in zip(obj[1]['events'], parts):
+                self.metrics.encoded(name, len(part))
+            encoded = '["state_update",{"events":[' + ','.join(parts) + ']}]'
+            self.metrics.encoded(event, len(encoded) - sum(len(part) for part in parts))
+            return encoded
+
+        encoded = json.dumps(obj, **kwargs)
+        self.metrics.encoded(event, len(encoded))
+        return encoded
+
+
+# Samples every thread's stack every `interval` seconds and counts how often each stack shows up.
+# collapsed() gives them in the "frame;frame;frame count" format flamegraph tools read.
+class SamplingProfiler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                        frame = frame.f_back
+                    key = ';'.join(reversed(stack))
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def collapsed(self):
+        with self._lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
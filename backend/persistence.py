@@ -0,0 +1,254 @@
+from collections import deque
+import json
+import os
+import re
+import threading
+import time
+import traceback
+
+# Keeps games alive across restarts: every change that goes through the state store is also
+# appended to an event log on disk, and every so often the whole lot is written out as a
+# compact snapshot so the log can be thrown away. On startup the snapshot is loaded and the
+# log after it is replayed.
+#
+# Files in the persist directory:
+#   snapshot.json       {'segment': n, 'rooms': [...]}, replay starts at log segment n
+#   log.<n>.jsonl       one JSON record per line
+#
+# Every record is absolute (a score, not a change to one; messages carry their seq), so
+# replaying a record the snapshot already includes does no harm.
+
+SEGMENT_PATTERN = re.compile(r'^log\.(\d+)\.jsonl$')
+
+
+# Append-only log with group commit. append() just queues the record, a background thread
+# writes and fsyncs everything queued every fsync_ms, so the hot path never touches the disk.
+class EventLog:
+    def __init__(self, directory, segment, fsync_ms=50):
+        self.directory = directory
+        self.segment = segment
+        self.fsync_interval = fsync_ms / 1000
+        self.bytes_written = 0
+        self.records_written = 0
+        self.fsyncs = 0
+        self._pending = []
+        self._lock = threading.Lock()     # Guards _pending
+        self._io_lock = threading.Lock()  # Guards the file
+        self._file = open(self._path(segment), 'ab', buffering=0)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f'log.{segment}.jsonl')
+
+    def append(self, record):
+        with self._lock:
+            self._pending.append(record)
+
+    # Write and fsync everything queued so far. If that fails the records are dropped rather than
+    # kept to retry, so a full disk can't make the queue grow forever (see Persistence._run).
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records or self._file is None:
+                return
+            # Turn records into JSON here rather than in append, to keep that off the hot path
+            data = ''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode('utf-8')
+            view = memoryview(data)
+            while view:
+                view = view[self._file.write(view):]
+            os.fsync(self._file.fileno())
+            self.bytes_written += len(data)
+            self.records_written += len(records)
+            self.fsyncs += 1
+
+    # Finish the current segment and start writing a new one. Returns the new segment number.
+    def roll(self):
+        self.flush()
+        with self._io_lock:
+            new_file = open(self._path(self.segment + 1), 'ab', buffering=0)
+            old_file, self._file = self._file, new_file
+            self.segment += 1
+        old_file.close()
+        return self.segment
+
+    def close(self):
+        self.flush()
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Wraps a state store (see state_store.py) so everything written to it also goes to the log
+class JournaledStore:
+    def __init__(self, store, log):
+        self.store = store
+        self.log = log
+
+    def __getattr__(self, name):
+        # Reads and anything else go straight to the real store
+        return getattr(self.store, name)
+
+    def save_room(self, session_id, info):
+        self.store.save_room(session_id, info)
+        self.log.append({'t': 'room', 's': session_id, 'info': info})
+
+    def delete_room(self, session_id):
+        self.store.delete_room(session_id)
+        self.log.append({'t': 'drop', 's': session_id})
+
+    def set_score(self, session_id, player_id, username, score):
+        self.store.set_score(session_id, player_id, username, score)
+        self.log.append({'t': 'score', 's': session_id, 'p': player_id, 'u': username, 'v': score})
+
+    # Not logged, players who leave keep their score so they can come back to it
+    def remove_player(self, session_id, player_id):
+        self.store.remove_player(session_id, player_id)
+
+    def append_message(self, session_id, entry, max_messages):
+        self.store.append_message(session_id, entry, max_messages)
+        self.log.append({'t': 'msg', 's': session_id, 'm': entry})
+
+
+def _new_room_state(max_messages):
+    return {'info': {}, 'players': {}, 'messages': deque(maxlen=max_messages), 'next_seq': 1}
+
+
+def _apply(rooms, record, max_messages):
+    kind = record['t']
+    session_id = record['s']
+    if kind == 'drop':
+        rooms.pop(session_id, None)
+        return
+
+    room = rooms.get(session_id)
+    if room is None:
+        room = rooms[session_id] = _new_room_state(max_messages)
+    if kind == 'room':
+        room['info'] = record['info']
+    elif kind == 'score':
+        room['players'][record['p']] = (record['u'], record['v'])
+    elif kind == 'msg':
+        entry = record['m']
+        if entry['seq'] >= room['next_seq']:
+            room['messages'].append(entry)
+            room['next_seq'] = entry['seq'] + 1
+
+
+# Load the snapshot and replay the log after it.
+# Returns ({session_id: {'info', 'players', 'messages', 'next_seq'}}, last segment number on disk).
+def load(directory, max_messages=200):
+    rooms = {}
+    start = 0
+    snapshot_path = os.path.join(directory, 'snapshot.json')
+    if os.path.exists(snapshot_path):
+        with open(snapshot_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        start = snapshot['segment']
+        for saved in snapshot['rooms']:
+            room = rooms[saved['session_id']] = _new_room_state(max_messages)
+            room['info'] = saved['info']
+            room['players'] = {player_id: (username, score) for player_id, username, score in saved['players']}
+            room['messages'].extend(saved['messages'])
+            room['next_seq'] = saved['next_seq']
+
+    segments = sorted(int(m.group(1)) for m in map(SEGMENT_PATTERN.match, os.listdir(directory)) if m)
+    for segment in segments:
+        if segment < start:
+            continue
+        with open(os.path.join(directory, f'log.{segment}.jsonl'), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Half a record, from a crash or a failed write. A failed write is always followed
+                    # by a snapshot, so whatever it lost is covered there.
+                    continue
+                _apply(rooms, record, max_messages)
+
+    return rooms, max(segments + [start])
+
+
+# Owns the log and the snapshots for one server process
+class Persistence:
+    def __init__(self, directory, fsync_ms=50, snapshot_interval=60, max_messages=200):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(directory, exist_ok=True)
+
+        started = time.perf_counter()
+        self.recovered, last_segment = load(directory, max_messages)
+        self.recovery_seconds = time.perf_counter() - started
+
+        self.log = EventLog(directory, last_segment + 1, fsync_ms)
+        self.snapshot_bytes_written = 0
+        self.snapshots = 0
+        self._registry = None
+        self._snapshot_due = False  # A log write failed, records are missing until the next snapshot
+        self._stopped = threading.Event()
+
+    # Write every room in the registry to a new snapshot and drop the log segments it covers
+    def snapshot(self, registry):
+        segment = self.log.roll()
+
+        rooms = []
+        for room in registry.rooms():
+            with room.lock:
+                players = list(room.players.values())
+                for same_name in room.detached.values():
+                    players.extend(same_name)
+                rooms.append({
+                    'session_id': room.session_id,
+                    'info': room.info(),
+                    'players': [[player.id, player.username, player.score] for player in players],
+                    'messages': list(room.messages),
+                    'next_seq': room.next_seq,
+                })
+
+        data = json.dumps({'segment': segment, 'rooms': rooms}, separators=(',', ':')).encode('utf-8')
+        path = os.path.join(self.directory, 'snapshot.json')
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)  # Either the old snapshot or the new one, never half of one
+        self.snapshot_bytes_written += len(data)
+        self.snapshots += 1
+
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match and int(match.group(1)) < segment:
+                os.remove(os.path.join(self.directory, name))
+
+    # Background thread: fsync the log every fsync_ms and snapshot every snapshot_interval seconds
+    def start(self, registry):
+        self._registry = registry
+        threading.Thread(target=self._run, name='persistence', daemon=True).start()
+
+    def _run(self):
+        last_snapshot = last_attempt = time.time()
+        while not self._stopped.wait(self.log.fsync_interval):
+            try:
+                self.log.flush()
+            except Exception:
+                # Those records are gone and the segment may end in half of one. A snapshot has
+                # everything they had, so take one as soon as the disk lets us.
+                traceback.print_exc()
+                self._snapshot_due = True
+
+            now = time.time()
+            scheduled = self.snapshot_interval > 0 and now - last_snapshot >= self.snapshot_interval
+            if (scheduled or self._snapshot_due) and now - last_attempt >= 1:
+                last_attempt = now
+                try:
+                    self.snapshot(self._registry)
+                except Exception:
+                    traceback.print_exc()  # Try again in a second
+                else:
+                    last_snapshot = now
+                    self._snapshot_due = False
+
+    # Write out everything still queued. Called at exit so a clean shutdown loses nothing.
+    def stop(self):
+        self._stopped.set()
+        self.log.close()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+# Measures what persistence costs: how much is written to disk for each change, how many
+# changes share one fsync, and how long recovery takes from the log alone and from a snapshot.
+# Drives the game handlers in-process, no sockets involved.
+
+
+# Throws away everything the game sends
+class NullOut:
+    def emit(self, event, data, to):
+        pass
+
+    def enter_room(self, sid, room):
+        pass
+
+    def leave_room(self, sid, room):
+        pass
+
+
+def run(rooms, players, events, directory):
+    # game reads its settings at import time
+    os.environ['PERSIST_DIR'] = directory
+    os.environ['SNAPSHOT_INTERVAL_S'] = '0'
+    import game
+    import persistence
+
+    out = NullOut()
+    started = time.perf_counter()
+    for r in range(rooms):
+        for p in range(players):
+            game.join(f'sid-{r}-{p}', {'username': f'p{p}', 'session_id': f'bench{r}'}, out)
+    for i in range(events):
+        r, p = i % rooms, (i // rooms) % players
+        session_id = f'bench{r}'
+        sid = f'sid-{r}-{p}'
+        if i % 2:
+            room = game.registry.get(session_id)
+            game.check_answer(sid, {'session_id': session_id, 'answer': 'wrong',
+                                    'question_id': room.current_question['question_id']}, out)
+        else:
+            game.send_message(sid, {'session_id': session_id, 'username': f'p{p}', 'message': f'message {i}'}, out)
+    handled = time.perf_counter() - started
+
+    log = game.persistence.log
+    log.flush()
+    log_bytes, records, fsyncs = log.bytes_written, log.records_written, log.fsyncs
+
+    # What the changes themselves add up to, without the log's framing, for write amplification
+    payload_bytes = 0
+    for name in os.listdir(directory):
+        if persistence.SEGMENT_PATTERN.match(name):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    body = record.get('info') or record.get('m') or [record['p'], record['u'], record['v']]
+                    payload_bytes += len(json.dumps(body, separators=(',', ':')))
+
+    started = time.perf_counter()
+    persistence.load(directory, game.MAX_ROOM_MESSAGES)
+    replay_seconds = time.perf_counter() - started
+
+    snapshot_before = game.persistence.snapshot_bytes_written
+    game.persistence.snapshot(game.registry)
+    snapshot_bytes = game.persistence.snapshot_bytes_written - snapshot_before
+
+    started = time.perf_counter()
+    persistence.load(directory, game.MAX_ROOM_MESSAGES)
+    snapshot_seconds = time.perf_counter() - started
+
+    return {
+        'rooms': rooms,
+        'players_per_room': players,
+        'events': events,
+        'events_per_sec': round(events / handled),
+        'log_records': records,
+        'log_bytes': log_bytes,
+        'log_bytes_per_record': round(log_bytes / records, 1),
+        'fsyncs': fsyncs,
+        'records_per_fsync': round(records / fsyncs, 1) if fsyncs else None,
+        'payload_bytes': payload_bytes,
+        'write_amplification': round(log_bytes / payload_bytes, 2),
+        'snapshot_bytes': snapshot_bytes,
+        'recovery_from_log_ms': round(replay_seconds * 1000, 1),
+        'recovery_from_snapshot_ms': round(snapshot_seconds * 1000, 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure event log write amplification and recovery time')
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--players', type=int, default=4, help='Players per room')
+    parser.add_argument('--events', type=int, default=100000, help='Answers and chat messages to send in total')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(json.dumps(run(args.rooms, args.players, args.events, tmp), indent=2))
@@ -0,0 +1,198 @@
+from array import array
+from decimal import Context, Decimal, DecimalException
+import csv
+import json
+import os
+import random
+import sqlite3
+import sys
+
+
+# Numbers with digits further than this from the decimal point are compared as plain text, so an
+# answer like "1e999999" can't overflow or turn into a megabyte of zeros
+MAX_ANSWER_EXPONENT = 100
+
+
+# Turn an answer into the form we compare on, so " 12 ", "12.0" and "12" are all the same answer.
+# Numbers are normalized through Decimal, anything else is lowercased with whitespace collapsed.
+def canonical_answer(answer):
+    text = ' '.join(str(answer).split()).lower()
+    try:
+        number = Decimal(text)
+        if not number.is_finite() or abs(number.adjusted()) > MAX_ANSWER_EXPONENT:
+            return text
+        if number == 0:
+            return '0'  # Don't let "-0" and "0" differ
+        # Enough precision for every digit, so two different numbers never round to the same answer
+        number = number.normalize(Context(prec=len(number.as_tuple().digits)))
+        return format(number, 'f')
+    except (DecimalException, ValueError):
+        return text
+
+
+# All loaded questions, stored column-wise so a big bank doesn't cost a dict per question.
+# Question IDs are just positions in these lists.
+class QuestionBank:
+    def __init__(self):
+        self.texts = []
+        self.answers = []        # Already canonical
+        # (category, difficulty) -> question IDs, with None meaning "any". This is the only place a
+        # question's category and difficulty are kept, nothing else needs them.
+        self._index = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, question, answer, category=None, difficulty=None):
+        question_id = len(self.texts)
+        self.texts.append(question)
+        self.answers.append(sys.intern(canonical_answer(answer)))  # Lots of questions share answers
+
+        category = str(category).strip().lower() if category not in (None, '') else None
+        difficulty = str(difficulty).strip().lower() if difficulty not in (None, '') else None
+        for key in {(None, None), (category, None), (None, difficulty), (category, difficulty)}:
+            self._index.setdefault(key, array('l')).append(question_id)
+        return question_id
+
+    # IDs of the questions matching the filters (None matches everything)
+    def select(self, category=None, difficulty=None):
+        if category is not None:
+            category = str(category).strip().lower()
+        if difficulty is not None:
+            difficulty = str(difficulty).strip().lower()
+        return self._index.get((category, difficulty), array('l'))
+
+    # Load a bank file, picking the format from the extension (.json, .csv, .db/.sqlite/.sqlite3)
+    def load(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.json':
+            self.load_json(path)
+        elif extension == '.csv':
+            self.load_csv(path)
+        elif extension in ('.db', '.sqlite', '.sqlite3'):
+            self.load_sqlite(path)
+        else:
+            raise ValueError(f'Unknown question bank format: {path}')
+        return self
+
+    # Either a list of {"question", "answer", "category", "difficulty"} objects or a dict of them
+    def load_json(self, path):
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.values()
+        for row in rows:
+            self.add(row['question'], row['answer'], row.get('category'), row.get('difficulty'))
+
+    # Header row needs question and answer columns, category and difficulty are optional
+    def load_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                self.add(row['question'], row['answer'], row.get('category'), row.get('difficulty'))
+
+    # Reads the questions table, category and difficulty columns are optional
+    def load_sqlite(self, path):
+        conn = sqlite3.connect(path)
+        try:
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(questions)')}
+            category = 'category' if 'category' in columns else 'NULL'
+            difficulty = 'difficulty' if 'difficulty' in columns else 'NULL'
+            query = f'SELECT question, answer, {category}, {difficulty} FROM questions'
+            for row in conn.execute(query):
+                self.add(*row)
+        finally:
+            conn.close()
+
+    def load_dict(self, questions):
+        for row in questions.values():
+            self.add(row['question'], row['answer'], row.get('category'), row.get('difficulty'))
+        return self
+
+
+# Makes up arithmetic questions on demand. Operand range and operators grow with difficulty.
+class ArithmeticGenerator:
+    LEVELS = {
+        'easy': (10, '+-'),
+        'medium': (50, '+-*'),
+        'hard': (200, '+-*/'),
+    }
+
+    def __init__(self, difficulty=None, rng=None):
+        self.max_operand, self.operators = self.LEVELS.get(str(difficulty or 'easy').strip().lower(), self.LEVELS['easy'])
+        self.rng = rng or random.Random()
+
+    # Returns (question_text, canonical_answer)
+    def generate(self):
+        rng = self.rng
+        operator = rng.choice(self.operators)
+        a = rng.randint(1, self.max_operand)
+        b = rng.randint(1, self.max_operand)
+        if operator == '+':
+            answer = a + b
+        elif operator == '-':
+            answer = a - b
+        elif operator == '*':
+            answer = a * b
+        else:
+            # Build division backwards so the answer is always a whole number
+            answer = b
+            a = a * b
+        return f"What's {a} {operator} {b}?", str(answer)
+
+
+# A room's own shuffled run through the bank. Nothing repeats until every matching question
+# has been used, then it starts a new round.
+#
+# The shuffle is a lazy Fisher-Yates: instead of copying and shuffling the matching IDs up front,
+# each draw picks a random undrawn position and moves the last undrawn question into its place,
+# remembering only the positions that have been swapped. Setting up a deck and drawing are both
+# O(1) however big the bank is, and a deck only costs memory for what it has drawn this round.
+#
+# With procedural=True (or no matching questions in the bank) questions are generated instead.
+class Deck:
+    def __init__(self, bank, category=None, difficulty=None, procedural=False, rng=None, next_generated_id=-1):
+        self.bank = bank
+        self.category = category
+        self.difficulty = difficulty
+        self.procedural = procedural
+        self.rng = rng or random.Random()
+        # The bank's own index of matching IDs, shared by every deck and never written to
+        self.ids = array('l') if procedural else bank.select(category, difficulty)
+        self.remaining = len(self.ids)  # Positions below this haven't been drawn this round
+        self.swapped = {}               # position -> question ID moved there this round
+        self.last = None
+        self.generator = ArithmeticGenerator(difficulty, self.rng) if not self.ids else None
+        # Generated questions get negative IDs so they never clash with the bank.
+        # Saved with the room so a restored room doesn't hand out the same IDs again.
+        self.next_generated_id = next_generated_id
+
+    def _at(self, position):
+        return self.swapped.get(position, self.ids[position])
+
+    # Returns (question_id, question_text, canonical_answer)
+    def draw(self):
+        if self.generator is not None:
+            text, answer = self.generator.generate()
+            question_id = self.next_generated_id
+            self.next_generated_id -= 1
+            return question_id, text, answer
+
+        if self.remaining == 0:
+            # Used them all, start a new round
+            self.remaining = len(self.ids)
+            self.swapped.clear()
+
+        position = self.rng.randrange(self.remaining)
+        if self.remaining == len(self.ids) and self.remaining > 1:
+            # Don't ask the same question twice in a row across rounds
+            while self._at(position) == self.last:
+                position = self.rng.randrange(self.remaining)
+
+        question_id = self._at(position)
+        last = self.remaining - 1
+        if position != last:
+            self.swapped[position] = self._at(last)
+        self.swapped.pop(last, None)
+        self.remaining = last
+        self.last = question_id
+        return question_id, self.bank.texts[question_id], self.bank.answers[question_id]
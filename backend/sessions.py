@@ -0,0 +1,221 @@
+from collections import deque
+from leaderboard import Leaderboard
+from state_store import MemoryStateStore
+import secrets
+import threading
+import time
+
+
+# One connected player. Keyed by socket ID, so two players with the same name don't collide
+class Player:
+    __slots__ = ('id', 'sid', 'username', 'score')
+
+    def __init__(self, player_id, sid, username):
+        self.id = player_id  # Public ID sent to clients, so we never hand out other players' socket IDs
+        self.sid = sid
+        self.username = username
+        self.score = 0  # Starting score is 0
+
+
+# One game session and everything that belongs to it
+class Room:
+    __slots__ = (
+        'session_id',
+        'epoch',                 # Random ID for this run of the room, message seqs start over when it changes
+        'players',               # sid -> Player
+        'detached',              # username -> [Player] who left under that name, most recent last, kept so
+                                 # they get their score back if they rejoin
+        'empty_since',           # When the last connected player left, None while anyone is here
+        'messages',              # Ring buffer of recent chat/system messages
+        'next_seq',              # Sequence number the next message will get
+        'deck',                  # This room's shuffled run through the question bank
+        'current_question',
+        'current_answer',        # Canonical answer to current_question, never sent to clients
+        'current_question_num',
+        'question_total_num',
+        'leaderboard',
+        'store',                 # Shared state store every change is written through to
+        'worker',                # Worker process that owns this room
+        'lock',                  # Guards everything above for this room only
+    )
+
+    def __init__(self, session_id, max_messages, store, worker=None, question_total_num=5):
+        self.session_id = session_id
+        self.epoch = secrets.token_hex(8)
+        self.players = {}
+        self.detached = {}
+        self.empty_since = None
+        self.messages = deque(maxlen=max_messages)
+        self.next_seq = 1
+        self.deck = None
+        self.current_question = None
+        self.current_answer = None
+        self.current_question_num = 1
+        self.question_total_num = question_total_num
+        self.leaderboard = Leaderboard()
+        self.store = store
+        self.worker = worker
+        self.lock = threading.RLock()
+
+    # Change a player's score and keep the leaderboard and store in step
+    def add_score(self, player, points):
+        player.score += points
+        self.leaderboard.set(player.id, player.username, player.score)
+        self.store.set_score(self.session_id, player.id, player.username, player.score)
+
+    # Publish the room's question progress to the store
+    def save(self):
+        self.store.save_room(self.session_id, self.info())
+
+    def info(self):
+        return {
+            'worker': self.worker,
+            'epoch': self.epoch,
+            'current_question_num': self.current_question_num,
+            'question_total_num': self.question_total_num,
+            'current_question': self.current_question,
+            'current_answer': self.current_answer,
+            'category': self.deck.category if self.deck else None,
+            'difficulty': self.deck.difficulty if self.deck else None,
+            'procedural': self.deck.procedural if self.deck else False,
+            'next_generated_id': self.deck.next_generated_id if self.deck else -1,
+        }
+
+
+# Keeps track of all rooms and which room each socket is in.
+#
+# Lock order is always registry lock -> room lock. The registry lock only guards the
+# two indexes and is held for O(1) work; per-room state is guarded by room.lock, so
+# events in different rooms never wait on each other.
+#
+# With idle_ttl set, players who leave are kept as detached and a room with nobody connected
+# stays around for idle_ttl seconds (see sweep), so people can come back to their scores.
+class SessionRegistry:
+    def __init__(self, max_messages=200, store=None, worker=None, idle_ttl=0):
+        self.max_messages = max_messages
+        self.store = store if store is not None else MemoryStateStore()
+        self.worker = worker
+        self.idle_ttl = idle_ttl
+        self._rooms = {}         # session_id -> Room
+        self._sid_to_room = {}   # sid -> session_id
+        self._lock = threading.Lock()
+        self._next_player_id = 1
+
+    def _new_player_id(self):
+        player_id = self._next_player_id
+        self._next_player_id += 1
+        return player_id
+
+    def get(self, session_id):
+        return self._rooms.get(session_id)
+
+    def room_ids(self):
+        return list(self._rooms.keys())
+
+    def rooms(self):
+        return list(self._rooms.values())
+
+    # Add a socket to a room, creating the room if needed.
+    # A socket can only be in one room, so joining a new one leaves the old one first.
+    # Someone rejoining under the name of a detached player takes that player (and score) back.
+    # When several players left under the same name, the one who left last is taken back.
+    # Returns (room, player, left) where left is the (room, player, now_empty) result of
+    # leaving a previous room, or None.
+    def join(self, sid, username, session_id):
+        left = None
+        if sid in self._sid_to_room and self._sid_to_room[sid] != session_id:
+            left = self.leave(sid)
+
+        with self._lock:
+            room = self._rooms.get(session_id)
+            if room is None:
+                room = Room(session_id, self.max_messages, self.store, self.worker)
+                self._rooms[session_id] = room
+                room.save()
+
+            with room.lock:
+                player = room.players.get(sid)
+                if player is None:
+                    same_name = room.detached.get(username)
+                    if same_name:
+                        player = same_name.pop()
+                        if not same_name:
+                            del room.detached[username]
+                        player.sid = sid
+                    else:
+                        player = Player(self._new_player_id(), sid, username)
+                    room.players[sid] = player
+                else:
+                    player.username = username
+                room.empty_since = None
+                room.leaderboard.set(player.id, player.username, player.score)
+                self.store.set_score(session_id, player.id, player.username, player.score)
+            self._sid_to_room[sid] = session_id
+
+        return room, player, left
+
+    # Remove a socket from whatever room it's in and drop the room once it's empty
+    # (or once it's been empty for idle_ttl, see sweep).
+    # Returns (room, player, now_empty), or None if the socket wasn't in a room.
+    def leave(self, sid):
+        with self._lock:
+            session_id = self._sid_to_room.pop(sid, None)
+            if session_id is None:
+                return None
+            room = self._rooms.get(session_id)
+            if room is None:
+                return None
+
+            with room.lock:
+                player = room.players.pop(sid, None)
+                if player is not None:
+                    room.leaderboard.remove(player.id)
+                    self.store.remove_player(session_id, player.id)
+                    if self.idle_ttl > 0:
+                        player.sid = None
+                        room.detached.setdefault(player.username, []).append(player)
+                now_empty = not room.players
+                if now_empty:
+                    if self.idle_ttl > 0:
+                        room.empty_since = time.time()
+                    else:
+                        del self._rooms[session_id]
+                        self.store.delete_room(session_id)
+
+        return room, player, now_empty
+
+    # Drop rooms nobody has been connected to for idle_ttl seconds. Returns their session IDs.
+    def sweep(self, now=None):
+        if self.idle_ttl <= 0:
+            return []
+        cutoff = (now or time.time()) - self.idle_ttl
+        dropped = []
+        with self._lock:
+            for session_id, room in list(self._rooms.items()):
+                with room.lock:
+                    if not room.players and room.empty_since is not None and room.empty_since < cutoff:
+                        del self._rooms[session_id]
+                        self.store.delete_room(session_id)
+                        dropped.append(session_id)
+        return dropped
+
+    # Put back a room recovered from disk (see persistence.py). Everyone in it starts out
+    # detached until they reconnect. Returns the new Room.
+    def restore(self, session_id, info, players, messages, next_seq):
+        with self._lock:
+            room = Room(session_id, self.max_messages, self.store, self.worker,
+                        info.get('question_total_num') or 5)
+            room.epoch = info.get('epoch') or room.epoch  # Same run of the room, so client cursors still hold
+            room.current_question_num = info.get('current_question_num') or 1
+            room.current_question = info.get('current_question')
+            room.current_answer = info.get('current_answer')
+            for player_id, username, score in players:
+                player = Player(player_id, None, username)
+                player.score = score
+                room.detached.setdefault(username, []).append(player)
+                self._next_player_id = max(self._next_player_id, player_id + 1)
+            room.messages.extend(messages)
+            room.next_seq = next_seq
+            room.empty_since = time.time()
+            self._rooms[session_id] = room
+        return room
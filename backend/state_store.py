@@ -0,0 +1,186 @@
+import sqlite3
+import threading
+import time
+import traceback
+
+
+# Where room state is published so it can be seen outside the process that runs the room.
+#
+# The live state is the Room objects in sessions.py, and each room only ever lives on the worker
+# that owns it (see cluster.py). Every change to rooms, scores and messages is written through
+# to the store as a mirror: /rooms on any worker reads the room list from it, and with the
+# sqlite backend anything else (another worker, a dashboard, sqlite3 on the command line) can
+# look at scores and messages without asking the game.
+#
+# Pick one with STATE_STORE: "memory" (default) or "sqlite:///path/to/state.db".
+def create_store(url=None):
+    if not url or url == 'memory':
+        return MemoryStateStore()
+    if url.startswith('sqlite:///'):
+        # sqlite:///state.db is relative to the working directory, sqlite:////tmp/state.db is absolute
+        return SqliteStateStore(url[len('sqlite:///'):])
+    raise ValueError(f'Unknown state store: {url}')
+
+
+# Just the room list, for a single process. Scores and messages are already in the Room objects
+# and nothing else could see them here, so they aren't copied.
+class MemoryStateStore:
+    def __init__(self):
+        self._rooms = {}     # session_id -> room info dict
+        self._lock = threading.Lock()
+
+    def save_room(self, session_id, info):
+        with self._lock:
+            self._rooms[session_id] = dict(info)
+
+    def delete_room(self, session_id):
+        with self._lock:
+            self._rooms.pop(session_id, None)
+
+    def room_ids(self):
+        return list(self._rooms.keys())
+
+    # Forget every room a worker owned, used when that worker starts up again
+    def delete_worker_rooms(self, worker):
+        for session_id, info in list(self._rooms.items()):
+            if info.get('worker') == worker:
+                self.delete_room(session_id)
+
+    def set_score(self, session_id, player_id, username, score):
+        pass
+
+    def remove_player(self, session_id, player_id):
+        pass
+
+    def append_message(self, session_id, entry, max_messages):
+        pass
+
+    def close(self):
+        pass
+
+
+# Shared between processes through one SQLite file in WAL mode.
+#
+# Writes are queued and a background thread commits everything queued every flush_ms in one
+# transaction, so a chat line or a score change never waits on SQLite while it holds the room
+# lock. Readers of the file see changes up to flush_ms late.
+class SqliteStateStore:
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS rooms (
+            session_id TEXT PRIMARY KEY,
+            worker INTEGER,
+            current_question_num INTEGER,
+            question_total_num INTEGER,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS players (
+            session_id TEXT,
+            player_id INTEGER,
+            username TEXT,
+            score INTEGER,
+            PRIMARY KEY (session_id, player_id)
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT,
+            seq INTEGER,
+            username TEXT,
+            message TEXT,
+            timestamp TEXT,
+            PRIMARY KEY (session_id, seq)
+        );
+    '''
+
+    def __init__(self, path, flush_ms=50):
+        self.path = path
+        self.flush_interval = flush_ms / 1000
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+        self._pending = []                  # (sql, params) waiting for the writer
+        self._lock = threading.Lock()       # Guards _pending
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run, name='state-store', daemon=True).start()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit, transactions are started by hand
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Durable enough for game state, much cheaper than FULL
+            self._local.conn = conn
+        return conn
+
+    def _queue(self, *statements):
+        with self._lock:
+            self._pending.extend(statements)
+
+    # Commit everything queued so far in one transaction
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                statements, self._pending = self._pending, []
+            if not statements:
+                return
+            conn = self._conn()
+            conn.execute('BEGIN')
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                # A mirror that's behind is better than one that stops, keep going with the next batch
+                traceback.print_exc()
+
+    def save_room(self, session_id, info):
+        self._queue((
+            'INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?)',
+            (session_id, info.get('worker'), info.get('current_question_num'),
+             info.get('question_total_num'), time.time())))
+
+    def delete_room(self, session_id):
+        self._queue(
+            ('DELETE FROM rooms WHERE session_id = ?', (session_id,)),
+            ('DELETE FROM players WHERE session_id = ?', (session_id,)),
+            ('DELETE FROM messages WHERE session_id = ?', (session_id,)))
+
+    def room_ids(self):
+        return [row[0] for row in self._conn().execute('SELECT session_id FROM rooms')]
+
+    # Forget every room a worker owned, used when that worker starts up again
+    def delete_worker_rooms(self, worker):
+        rows = self._conn().execute('SELECT session_id FROM rooms WHERE worker IS ?', (worker,)).fetchall()
+        for (session_id,) in rows:
+            self.delete_room(session_id)
+        self.flush()
+
+    def set_score(self, session_id, player_id, username, score):
+        self._queue((
+            'INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?)',
+            (session_id, player_id, username, score)))
+
+    def remove_player(self, session_id, player_id):
+        self._queue(('DELETE FROM players WHERE session_id = ? AND player_id = ?', (session_id, player_id)))
+
+    def append_message(self, session_id, entry, max_messages):
+        self._queue(
+            ('INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)',
+             (session_id, entry['seq'], entry['username'], entry['message'], entry['timestamp'])),
+            # Same cap as the in-memory ring buffer
+            ('DELETE FROM messages WHERE session_id = ? AND seq <= ?', (session_id, entry['seq'] - max_messages)))
+
+    def close(self):
+        self._stopped.set()
+        self.flush()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,112 @@
+import threading
+import time
+
+from actors import ActorScheduler, FrameBatcher
+import game
+
+
+# Keeps every frame sent, as (target, events), in the order they were sent
+class RecordingTransport:
+    def __init__(self):
+        self.frames = []
+        self._lock = threading.Lock()
+
+    def enter_room(self, sid, room):
+        pass
+
+    def leave_room(self, sid, room):
+        pass
+
+    def send_frame(self, target, events):
+        with self._lock:
+            self.frames.append((target, events))
+
+
+# Wait until everything already queued for a room has been handled and sent. The first marker may
+# share a tick with the last events, whose frames go out after it runs. The second one is queued
+# while that tick is still going, so it only runs once those frames are out.
+def drain(scheduler, session_id):
+    for _ in range(2):
+        done = threading.Event()
+        scheduler.submit(session_id, lambda out: done.set())
+        assert done.wait(5)
+
+
+def test_a_room_handles_one_event_at_a_time_in_arrival_order():
+    scheduler = ActorScheduler(RecordingTransport(), lambda session_id: True, workers=8)
+    handled = []
+    running = []
+    overlaps = []
+
+    def handler(i, out):
+        running.append(i)
+        if len(running) > 1:
+            overlaps.append(list(running))
+        time.sleep(0.0005)
+        handled.append(i)
+        running.remove(i)
+
+    for i in range(300):
+        scheduler.submit('room1', handler, i)
+    drain(scheduler, 'room1')
+    assert handled == list(range(300))
+    assert overlaps == []
+
+
+def test_rooms_do_not_wait_on_each_other():
+    scheduler = ActorScheduler(RecordingTransport(), lambda session_id: True, workers=2)
+    release = threading.Event()
+    other_ran = threading.Event()
+    scheduler.submit('slow', lambda out: release.wait(5))
+    scheduler.submit('fast', lambda out: other_ran.set())
+    assert other_ran.wait(5)
+    release.set()
+
+
+def test_frames_for_single_sockets_go_before_the_room_frame():
+    batch = FrameBatcher('room1')
+    batch.emit('new_message', {'seq': 5}, 'room1')
+    batch.emit('room_messages', {'last_seq': 4}, 'sid-a')
+    batch.emit('question', {}, 'room1')
+    batch.emit('leaderboard', {}, 'sid-a')
+    assert batch.take_frames() == [
+        ('sid-a', [['room_messages', {'last_seq': 4}], ['leaderboard', {}]]),
+        ('room1', [['new_message', {'seq': 5}], ['question', {}]]),
+    ]
+    assert batch.take_frames() == []
+
+
+def test_joiner_gets_the_backlog_before_the_rooms_new_messages():
+    transport = RecordingTransport()
+    scheduler = ActorScheduler(transport, game.room_exists)
+    scheduler.submit_join('order-a', 'actors-order', game.join, 'order-a',
+                          {'username': 'alice', 'session_id': 'actors-order'})
+    drain(scheduler, 'actors-order')
+
+    targets = [target for target, events in transport.frames]
+    assert targets == ['order-a', 'actors-order']
+    assert transport.frames[0][1][0][0] == 'room_messages'
+    assert 'new_message' in [event for event, data in transport.frames[1][1]]
+
+
+def test_first_correct_answer_wins():
+    transport = RecordingTransport()
+    scheduler = ActorScheduler(transport, game.room_exists, workers=8)
+    for sid, username in (('race-a', 'alice'), ('race-b', 'bob')):
+        scheduler.submit_join(sid, 'actors-race', game.join, sid,
+                              {'username': username, 'session_id': 'actors-race'})
+    drain(scheduler, 'actors-race')
+
+    room = game.registry.get('actors-race')
+    answer = {'session_id': 'actors-race', 'question_id': room.current_question['question_id'],
+              'answer': room.current_answer}
+    transport.frames.clear()
+    scheduler.submit('actors-race', game.check_answer, 'race-a', answer)
+    scheduler.submit('actors-race', game.check_answer, 'race-b', answer)
+    drain(scheduler, 'actors-race')
+
+    # Both may be handled in one tick, where bob's own frame goes out before the room's
+    results = sorted((data['username'], data['status'], target) for target, events in transport.frames
+                     for event, data in events if event == 'answer_result')
+    assert results == [('alice', 'correct', 'actors-race'), ('bob', 'too_late', 'race-b')]
+    assert room.current_question_num == 2
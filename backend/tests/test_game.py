@@ -0,0 +1,97 @@
+import game
+from sessions import Room
+from state_store import MemoryStateStore
+
+
+# Keeps everything the game sends, as (event, data, to)
+class Recorder:
+    def __init__(self):
+        self.sent = []
+
+    def emit(self, event, data, to):
+        self.sent.append((event, data, to))
+
+    def enter_room(self, sid, room):
+        pass
+
+    def leave_room(self, sid, room):
+        pass
+
+    def events(self, name):
+        return [(data, to) for event, data, to in self.sent if event == name]
+
+
+def answer(sid, session_id, out, correct=True):
+    room = game.registry.get(session_id)
+    game.check_answer(sid, {'session_id': session_id,
+                            'question_id': room.current_question['question_id'],
+                            'answer': room.current_answer if correct else 'wrong'}, out)
+
+
+def test_joining_after_the_game_ended_draws_no_question():
+    out = Recorder()
+    game.join('end-a', {'username': 'alice', 'session_id': 'ended'}, out)
+    room = game.registry.get('ended')
+    for _ in range(room.question_total_num):
+        answer('end-a', 'ended', out)
+    assert room.current_question is None
+
+    out = Recorder()
+    game.join('end-b', {'username': 'bob', 'session_id': 'ended'}, out)
+    assert out.events('question') == []
+    assert out.events('game_end') == [({'message': 'Game ended!'}, 'end-b')]
+
+
+def test_messages_since_returns_only_newer_messages():
+    room = Room('since', 3, MemoryStateStore())
+    assert game.messages_since(room, 0) == []
+    for i in range(5):
+        game.add_room_message(room, None, f'message {i}', Recorder())
+
+    # Seqs 1 and 2 have dropped out of the buffer
+    assert [entry['seq'] for entry in game.messages_since(room, 0)] == [3, 4, 5]
+    assert [entry['seq'] for entry in game.messages_since(room, 1)] == [3, 4, 5]
+    assert [entry['seq'] for entry in game.messages_since(room, 3)] == [4, 5]
+    assert game.messages_since(room, 5) == []
+    assert game.messages_since(room, 99) == []
+
+
+def backlog(out, sid):
+    [(data, to)] = out.events('room_messages')
+    assert to == sid
+    return data
+
+
+def test_rejoin_gets_only_what_it_missed_in_the_same_room_run():
+    out = Recorder()
+    game.join('cursor-a', {'username': 'alice', 'session_id': 'cursor'}, out)
+    first = backlog(out, 'cursor-a')
+    game.send_message('cursor-a', {'session_id': 'cursor', 'username': 'alice', 'message': 'hi'}, out)
+
+    out = Recorder()
+    game.join('cursor-b', {'username': 'bob', 'session_id': 'cursor',
+                           'last_seq': first['last_seq'], 'epoch': first['epoch']}, out)
+    data = backlog(out, 'cursor-b')
+    assert [entry['message'] for entry in data['messages']] == ['alice has joined the game!', 'hi']
+    assert data['epoch'] == first['epoch']
+
+    out = Recorder()
+    game.join('cursor-c', {'username': 'carol', 'session_id': 'cursor',
+                           'last_seq': data['last_seq'], 'epoch': data['epoch']}, out)
+    assert [entry['message'] for entry in backlog(out, 'cursor-c')['messages']] == ['bob has joined the game!']
+
+
+def test_cursor_from_another_room_run_starts_over():
+    out = Recorder()
+    game.join('epoch-a', {'username': 'alice', 'session_id': 'epoch'}, out)
+    room = game.registry.get('epoch')
+    everything = list(room.messages)
+
+    for cursor in ({'last_seq': 99, 'epoch': 'an-old-run'},
+                   {'last_seq': 99},
+                   {'last_seq': 'not a number', 'epoch': room.epoch}):
+        out = Recorder()
+        game.join('epoch-b', dict(cursor, username='bob', session_id='epoch'), out)
+        data = backlog(out, 'epoch-b')
+        assert data['epoch'] == room.epoch
+        assert data['messages'][:len(everything)] == everything
@@ -0,0 +1,110 @@
+import random
+
+from leaderboard import Leaderboard, RankedList
+
+
+def test_ranked_list_matches_sorted_list():
+    rng = random.Random(1)
+    ranked = RankedList()
+    model = []
+    for _ in range(3000):
+        if model and rng.random() < 0.4:
+            key = rng.choice(model)
+            assert ranked.remove(key) == model.index(key)
+            model.remove(key)
+        else:
+            key = (rng.randint(-50, 50), rng.random())
+            model.append(key)
+            model.sort()
+            assert ranked.insert(key) == model.index(key)
+        assert len(ranked) == len(model)
+        if model:
+            start = rng.randrange(len(model))
+            assert list(ranked.iter_from(start, 5)) == model[start:start + 5]
+            key = rng.choice(model)
+            assert ranked.rank(key) == model.index(key)
+    assert list(ranked.iter_from(0)) == model
+
+
+def test_remove_missing_key_raises():
+    ranked = RankedList()
+    ranked.insert((1, 0))
+    try:
+        ranked.remove((2, 0))
+    except KeyError:
+        pass
+    else:
+        assert False, 'expected KeyError'
+
+
+def test_top_is_sorted_with_first_come_first_ranked_ties():
+    board = Leaderboard()
+    board.set(1, 'a', 100)
+    board.set(2, 'b', 200)
+    board.set(3, 'c', 100)
+    assert board.top() == [[2, 'b', 200], [1, 'a', 100], [3, 'c', 100]]
+    assert board.top(1) == [[2, 'b', 200]]
+
+
+def test_changes_only_include_moved_rows():
+    board = Leaderboard()
+    for player_id in range(1, 5):
+        board.set(player_id, f'p{player_id}', 0)
+    board.changes()
+
+    board.set(4, 'p4', 100)  # Last to first, everyone else moves down one
+    changed, removed = board.changes()
+    assert sorted(row[0] for row in changed) == [1, 2, 3, 4]
+    assert removed == []
+
+    board.set(2, 'p2', -50)  # 2 drops from rank 2 to the bottom, only ranks 2..3 move
+    changed, removed = board.changes()
+    assert changed == [[3, 'p3', 0, 2], [2, 'p2', -50, 3]]
+    assert not board.has_changes()
+
+
+def test_username_change_is_sent():
+    board = Leaderboard()
+    board.set(1, 'old', 10)
+    board.changes()
+    board.set(1, 'new', 10)
+    assert board.changes() == ([[1, 'new', 10, 0]], [])
+
+
+def test_removed_players_are_reported_once():
+    board = Leaderboard()
+    board.set(1, 'a', 10)
+    board.set(2, 'b', 5)
+    board.changes()
+    board.remove(1)
+    assert board.changes() == ([[2, 'b', 5, 0]], [1])
+    assert board.changes() == ([], [])
+
+
+def test_deltas_rebuild_the_full_board():
+    # A client that only applies the deltas must always end up with the same board as top()
+    rng = random.Random(7)
+    board = Leaderboard()
+    client = {}
+    scores = {}
+    for step in range(2000):
+        action = rng.random()
+        if scores and action < 0.15:
+            player_id = rng.choice(list(scores))
+            board.remove(player_id)
+            del scores[player_id]
+        else:
+            player_id = rng.randint(1, 30)
+            username = f'p{player_id}-{rng.randint(0, 2)}'
+            scores[player_id] = scores.get(player_id, 0) + rng.choice((100, -50, 0))
+            board.set(player_id, username, scores[player_id])
+
+        if rng.random() < 0.3:
+            changed, removed = board.changes()
+            for player_id in removed:
+                client.pop(player_id, None)
+            for player_id, username, score, rank in changed:
+                client[player_id] = (rank, player_id, username, score)
+            expected = [(rank, player_id, username, score)
+                        for rank, (player_id, username, score) in enumerate(board.top())]
+            assert sorted(client.values()) == expected, step
@@ -0,0 +1,155 @@
+import json
+import os
+
+import pytest
+
+from persistence import JournaledStore, Persistence, load
+from sessions import SessionRegistry
+from state_store import MemoryStateStore
+
+
+def open_registry(directory):
+    persistence = Persistence(str(directory), snapshot_interval=0)
+    store = JournaledStore(MemoryStateStore(), persistence.log)
+    return persistence, SessionRegistry(store=store)
+
+
+def say(room, text):
+    entry = {'seq': room.next_seq, 'username': 'system', 'message': text}
+    room.messages.append(entry)
+    room.next_seq += 1
+    room.store.append_message(room.session_id, entry, 200)
+
+
+def test_log_replays_into_rooms(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+    room.add_score(alice, 100)
+    say(room, 'hello')
+    registry.join('sid-b', 'bob', 'room2')
+    registry.leave('sid-b')  # No idle_ttl, so room2 is dropped
+    persistence.stop()
+
+    rooms, _ = load(str(tmp_path))
+    assert set(rooms) == {'room1'}
+    assert rooms['room1']['players'] == {alice.id: ('alice', 100)}
+    assert [entry['message'] for entry in rooms['room1']['messages']] == ['hello']
+    assert rooms['room1']['next_seq'] == 2
+    assert rooms['room1']['info']['epoch'] == room.epoch
+
+
+def test_snapshot_and_later_log_round_trip(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+    room.add_score(alice, 100)
+    say(room, 'before')
+    persistence.snapshot(registry)
+    room.add_score(alice, 50)
+    say(room, 'after')
+    persistence.stop()
+
+    # Segments the snapshot covers are gone
+    segments = sorted(name for name in os.listdir(tmp_path) if name.startswith('log.'))
+    assert segments == [f'log.{persistence.log.segment}.jsonl']
+
+    rooms, last_segment = load(str(tmp_path))
+    assert last_segment == persistence.log.segment
+    assert rooms['room1']['players'] == {alice.id: ('alice', 150)}
+    assert [entry['message'] for entry in rooms['room1']['messages']] == ['before', 'after']
+    assert rooms['room1']['next_seq'] == 3
+
+
+def test_replaying_what_the_snapshot_has_changes_nothing(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+    room.add_score(alice, 100)
+    say(room, 'hello')
+    persistence.snapshot(registry)
+
+    # The same records again after the snapshot
+    room.store.set_score('room1', alice.id, 'alice', 100)
+    room.store.append_message('room1', room.messages[-1], 200)
+    persistence.stop()
+
+    rooms, _ = load(str(tmp_path))
+    assert rooms['room1']['players'] == {alice.id: ('alice', 100)}
+    assert [entry['message'] for entry in rooms['room1']['messages']] == ['hello']
+
+
+def test_recovered_rooms_restore(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+    room.add_score(alice, 100)
+    say(room, 'hello')
+    persistence.stop()
+
+    persistence, registry = open_registry(tmp_path)
+    saved = persistence.recovered['room1']
+    restored = registry.restore('room1', saved['info'], [(player_id, username, score)
+                                for player_id, (username, score) in saved['players'].items()],
+                                saved['messages'], saved['next_seq'])
+    persistence.stop()
+    assert restored.epoch == room.epoch
+    assert restored.next_seq == 2
+    assert [player.score for player in restored.detached['alice']] == [100]
+
+
+def test_snapshot_keeps_detached_players_with_the_same_name(tmp_path):
+    persistence = Persistence(str(tmp_path), snapshot_interval=0)
+    registry = SessionRegistry(store=JournaledStore(MemoryStateStore(), persistence.log), idle_ttl=60)
+    room, first, _ = registry.join('sid-1', 'bob', 'room1')
+    _, second, _ = registry.join('sid-2', 'bob', 'room1')
+    room.add_score(first, 300)
+    room.add_score(second, -50)
+    registry.leave('sid-1')
+    registry.leave('sid-2')
+    persistence.snapshot(registry)
+    persistence.stop()
+
+    rooms, _ = load(str(tmp_path))
+    assert rooms['room1']['players'] == {first.id: ('bob', 300), second.id: ('bob', -50)}
+
+
+def test_half_written_lines_are_skipped(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+    persistence.log.flush()
+    with open(tmp_path / f'log.{persistence.log.segment}.jsonl', 'ab') as f:
+        f.write(b'{"t":"score","s":"room1"\n')
+    room.add_score(alice, 100)
+    persistence.stop()
+
+    rooms, _ = load(str(tmp_path))
+    assert rooms['room1']['players'] == {alice.id: ('alice', 100)}
+
+
+def test_failed_write_drops_the_batch(tmp_path, monkeypatch):
+    persistence, registry = open_registry(tmp_path)
+    room, alice, _ = registry.join('sid-a', 'alice', 'room1')
+
+    def disk_full(fd):
+        raise OSError(28, 'No space left on device')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, 'fsync', disk_full)
+        with pytest.raises(OSError):
+            persistence.log.flush()
+    assert persistence.log._pending == []
+
+    # Once the disk is back a snapshot covers what was lost
+    persistence.snapshot(registry)
+    persistence.stop()
+    rooms, _ = load(str(tmp_path))
+    assert rooms['room1']['players'] == {alice.id: ('alice', 0)}
+
+
+def test_stop_writes_everything_queued(tmp_path):
+    persistence, registry = open_registry(tmp_path)
+    registry.join('sid-a', 'alice', 'room1')
+    persistence.stop()
+    persistence.log.append({'t': 'drop', 's': 'room1'})
+    persistence.log.flush()  # Closed already, nothing happens
+
+    path = tmp_path / f'log.{persistence.log.segment}.jsonl'
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [record['t'] for record in records] == ['room', 'score']
@@ -0,0 +1,76 @@
+import random
+
+from questions import Deck, QuestionBank, canonical_answer
+
+
+def test_numbers_compare_by_value():
+    assert canonical_answer(' 12 ') == '12'
+    assert canonical_answer('12.0') == '12'
+    assert canonical_answer('1.2e1') == '12'
+    assert canonical_answer('-0') == '0'
+    assert canonical_answer('0.50') == '0.5'
+
+
+def test_text_is_lowercased_and_whitespace_collapsed():
+    assert canonical_answer('  Paris ') == 'paris'
+    assert canonical_answer('New   York') == 'new york'
+    assert canonical_answer('NaN') == 'nan'
+    assert canonical_answer('inf') == 'inf'
+
+
+def test_long_numbers_are_not_rounded_together():
+    assert canonical_answer('1.00000000000000000000000000000001') != canonical_answer('1')
+    assert canonical_answer('123456789012345678901234567890123') == '123456789012345678901234567890123'
+
+
+def test_huge_exponents_stay_text():
+    assert canonical_answer('1e9999999') == '1e9999999'
+    assert canonical_answer('1e999999') == '1e999999'
+    assert canonical_answer('1e-999999') == '1e-999999'
+    assert canonical_answer('1e100') == '1' + '0' * 100
+
+
+def make_bank(count, category=None):
+    bank = QuestionBank()
+    for i in range(count):
+        bank.add(f'q{i}', str(i), category)
+    return bank
+
+
+def test_deck_uses_every_question_once_per_round():
+    bank = make_bank(50)
+    deck = Deck(bank, rng=random.Random(3))
+    for _ in range(3):
+        drawn = [deck.draw()[0] for _ in range(50)]
+        assert sorted(drawn) == list(range(50))
+
+
+def test_deck_never_repeats_across_rounds():
+    bank = make_bank(2)
+    deck = Deck(bank, rng=random.Random(5))
+    drawn = [deck.draw()[0] for _ in range(200)]
+    assert all(a != b for a, b in zip(drawn, drawn[1:]))
+
+
+def test_deck_draws_only_matching_questions_with_answers():
+    bank = make_bank(10, 'math')
+    bank.add('Capital of France?', 'Paris', 'geography')
+    deck = Deck(bank, category='Geography', rng=random.Random(1))
+    assert deck.draw() == (10, 'Capital of France?', 'paris')
+    assert deck.draw() == (10, 'Capital of France?', 'paris')
+
+
+def test_deck_setup_does_not_copy_the_bank():
+    bank = make_bank(100000)
+    deck = Deck(bank)
+    assert deck.ids is bank.select()
+    deck.draw()
+    assert len(deck.swapped) <= 1
+
+
+def test_generated_questions_continue_from_saved_id():
+    deck = Deck(QuestionBank(), procedural=True, next_generated_id=-7)
+    question_id, text, answer = deck.draw()
+    assert question_id == -7
+    assert deck.next_generated_id == -8
+    assert text.startswith("What's ")
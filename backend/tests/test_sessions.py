@@ -0,0 +1,32 @@
+from sessions import SessionRegistry
+
+
+def test_players_with_the_same_name_keep_their_own_scores():
+    registry = SessionRegistry(idle_ttl=60)
+    room, first, _ = registry.join('sid-1', 'bob', 'room1')
+    _, second, _ = registry.join('sid-2', 'bob', 'room1')
+    room.add_score(first, 300)
+    room.add_score(second, -50)
+    registry.leave('sid-1')
+    registry.leave('sid-2')
+    assert [(player.id, player.score) for player in room.detached['bob']] == [(first.id, 300), (second.id, -50)]
+
+    # Whoever left last is taken back first
+    _, player, _ = registry.join('sid-3', 'bob', 'room1')
+    assert player is second
+    _, player, _ = registry.join('sid-4', 'bob', 'room1')
+    assert player is first and player.score == 300
+    assert room.detached == {}
+
+    _, player, _ = registry.join('sid-5', 'bob', 'room1')
+    assert player.id not in (first.id, second.id) and player.score == 0
+
+
+def test_restored_players_with_the_same_name_all_come_back():
+    registry = SessionRegistry(idle_ttl=60)
+    room = registry.restore('room1', {}, [(1, 'bob', 300), (2, 'bob', -50)], [], 1)
+    assert sorted(player.score for player in room.detached['bob']) == [-50, 300]
+
+    scores = {registry.join(f'sid-{i}', 'bob', 'room1')[1].score for i in range(2)}
+    assert scores == {-50, 300}
+    assert registry.join('sid-new', 'alice', 'room1')[1].id == 3
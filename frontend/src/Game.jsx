@@ -14,6 +14,8 @@ function Game() {
   const [sessionId, setSessionId] = useState("");
 
   const socket = useRef(null);
+  const lastSeq = useRef(0); // Sequence number of the newest chat message we've seen
+  const epoch = useRef(null); // Which run of the room lastSeq belongs to, seqs start over with a new one
 
   useEffect(() => {
     const params = new URLSearchParams(window.location.search);
@@ -23,56 +25,97 @@ function Game() {
     setUsername(username);
     setSessionId(sessionId);
 
-    socket.current = io('http://localhost:3000', {
-      withCredentials: true,
-      transports: ['websocket', 'polling'],
-    });
-
-    socket.current.emit('join', { username: username, session_id: sessionId });
-
-    socket.current.on('joined', (data) => {
-      console.log(data.message);
-    });
-
-    socket.current.on('question', (data) => {
-      setQuestion(data.question_text);
-      setQuestionId(data.question_id);
-      setQuestionNum(data.current_question_num);
-      setQuestionTotalNum(data.question_total_num);
-    });
-
-    socket.current.on('answer_result', (data) => {
-      if (data.username !== username) {
-        setMessages((prevMessages) => [
-          ...prevMessages,
-          { username: data.username, message: `${data.username} got the answer ${data.status}.` },
-        ]);
-      } else if (data.username === username) {
-        setMessages((prevMessages) => [
-          ...prevMessages,
-          { username: data.username, message: `Your answer is ${data.status}.` },
-        ]);
-      }
-    });
-
-    socket.current.on('user_left', (data) => {
-      setMessages((prevMessages) => [
-        ...prevMessages,
-        { message: data.message },
-      ]);
-    });
-
-    socket.current.on('leaderboard', (data) => {
-      setLeaderboard(data.leaderboard);
-    });
-
-    socket.current.on('room_messages', (data) => {
-      setMessages(data.messages);
-    });
+    const connect = (url) => {
+      socket.current = io(url, {
+        withCredentials: true,
+        transports: ['websocket', 'polling'],
+      });
+
+      // (Re)join on every connect, sending our cursor so the server only sends messages we missed
+      socket.current.on('connect', () => {
+        socket.current.emit('join', { username: username, session_id: sessionId, last_seq: lastSeq.current, epoch: epoch.current });
+      });
+
+      socket.current.on('joined', (data) => {
+        console.log(data.message);
+      });
+
+      socket.current.on('question', (data) => {
+        setQuestion(data.question_text);
+        setQuestionId(data.question_id);
+        setQuestionNum(data.current_question_num);
+        setQuestionTotalNum(data.question_total_num);
+      });
+
+      socket.current.on('answer_result', (data) => {
+        // The result message itself arrives through new_message
+        console.log(`${data.username} got the answer ${data.status}.`);
+      });
+
+      socket.current.on('user_left', (data) => {
+        console.log(data.message);
+      });
+
+      // Full leaderboard in rank order, sent once when we join. Rows are [player_id, username, score],
+      // kept with their rank added so updates can be merged in
+      socket.current.on('leaderboard', (data) => {
+        setLeaderboard(data.leaderboard.map((row, rank) => [...row, rank]));
+      });
+
+      // Only the rows that changed since the last update, as [player_id, username, score, rank].
+      // Order by the server's rank, not the score, so ties stay in the order the server broke them.
+      socket.current.on('leaderboard_update', (data) => {
+        setLeaderboard((prevLeaderboard) => {
+          const rows = new Map(prevLeaderboard.map((row) => [row[0], row]));
+          data.removed.forEach((playerId) => rows.delete(playerId));
+          data.changes.forEach(([playerId, name, score, rank]) => rows.set(playerId, [playerId, name, score, rank]));
+          return [...rows.values()].sort((a, b) => a[3] - b[3]);
+        });
+      });
+
+      // Backlog of messages we missed, sent once when we join
+      socket.current.on('room_messages', (data) => {
+        if (data.epoch !== epoch.current) {
+          // The room was dropped and started again (or the server restarted), our cursor means nothing now
+          epoch.current = data.epoch;
+          lastSeq.current = 0;
+        }
+        const missed = data.messages.filter((msg) => msg.seq > lastSeq.current);
+        lastSeq.current = Math.max(lastSeq.current, data.last_seq);
+        if (missed.length > 0) {
+          setMessages((prevMessages) => [...prevMessages, ...missed]);
+        }
+      });
+
+      // A single new message in the room
+      socket.current.on('new_message', (msg) => {
+        if (msg.seq <= lastSeq.current) {
+          return; // Already have it
+        }
+        lastSeq.current = msg.seq;
+        setMessages((prevMessages) => [...prevMessages, msg]);
+      });
+
+      socket.current.on('game_end', (data) => {
+        setQuestion(data.message);
+      });
+
+      // The room lives on another server, move over there
+      socket.current.on('redirect', (data) => {
+        socket.current.disconnect();
+        connect(data.url);
+      });
+
+      // Several events batched into one frame by the server, handle them in order
+      const current = socket.current;
+      current.on('state_update', (data) => {
+        data.events.forEach(([event, payload]) => {
+          current.listeners(event).forEach((listener) => listener(payload));
+        });
+      });
+    };
 
-    socket.current.on('game_end', (data) => {
-      setQuestion(data.message);
-    });
+    connect('http://localhost:3000');
 
     return () => {
       if (socket.current) {
@@ -133,8 +176,8 @@ function Game() {
         <div style={{ width: '100%', marginBottom: '20px' }}>
           <h2>Leaderboard</h2>
           <ul>
-            {leaderboard.map(([username, score]) => (
-              <li key={username}>{username}: {score}</li>
+            {leaderboard.map(([playerId, username, score]) => (
+              <li key={playerId}>{username}: {score}</li>
             ))}
           </ul>
         </div>
@@ -144,7 +187,7 @@ function Game() {
           <div style={{ maxHeight: '200px', overflowY: 'auto', border: '1px solid #ccc', padding: '10px', marginBottom: '10px' }}>
             {messages.length > 0 ? (
               messages.slice(-10).map((msg, index) => (
-                <div key={index}>
+                <div key={msg.seq ?? index}>
                     {msg.username ? (
                     <>
                         <strong>{msg.username}</strong>: {msg.message}